@@ -0,0 +1,112 @@
+import os
+import uuid
+import logging
+import threading
+
+# Optional backend: Qdrant for the vector index and fastembed for local question embeddings.
+# Without either (or without ANSWER_CACHE_QDRANT_URL) the cache is disabled and every question runs the agent.
+try:
+    from qdrant_client import QdrantClient, models
+except ImportError:
+    QdrantClient = None
+
+try:
+    from fastembed import TextEmbedding
+except ImportError:
+    TextEmbedding = None
+
+log = logging.getLogger(__name__)
+
+# A Qdrant URL, or ":memory:" for a per-process index
+ANSWER_CACHE_QDRANT_URL = os.getenv("ANSWER_CACHE_QDRANT_URL")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_COLLECTION = os.getenv("ANSWER_CACHE_COLLECTION", "agent_answers")
+
+
+class AnswerCache:
+    """Semantic cache of final agent answers: a near-duplicate question reuses the stored answer."""
+
+    def __init__(self, url: str = ANSWER_CACHE_QDRANT_URL, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 collection: str = ANSWER_CACHE_COLLECTION, embed_model: str = "BAAI/bge-small-en-v1.5"):
+        self.threshold = threshold
+        self.collection = collection
+        self._embed_model = embed_model
+        self._embedder = None
+        self._client = None
+        self._ready = False
+        self._lock = threading.Lock()
+        if url and QdrantClient is not None and TextEmbedding is not None:
+            self._client = QdrantClient(location=url) if url == ":memory:" else QdrantClient(url=url)
+        elif url:
+            log.warning("qdrant-client or fastembed not installed; answer cache disabled.")
+
+    @property
+    def enabled(self) -> bool:
+        return self._client is not None
+
+    def _embed(self, text: str) -> list:
+        # The embedding model is loaded on first use so importing the module stays cheap
+        if self._embedder is None:
+            with self._lock:
+                if self._embedder is None:
+                    self._embedder = TextEmbedding(self._embed_model)
+        return next(iter(self._embedder.embed([text]))).tolist()
+
+    def _ensure_collection(self, size: int):
+        if self._ready:
+            return
+        with self._lock:
+            if not self._client.collection_exists(self.collection):
+                self._client.create_collection(
+                    self.collection,
+                    vectors_config=models.VectorParams(size=size, distance=models.Distance.COSINE),
+                    # int8 vectors held in RAM: a quarter of the float32 footprint, rescored on the originals
+                    quantization_config=models.ScalarQuantization(
+                        scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, always_ram=True),
+                    ),
+                )
+            self._ready = True
+
+    def get(self, question: str):
+        """Returns (answer, vector); answer is None on a miss, and vector can be passed back to set()."""
+        if self._client is None:
+            return None, None
+        try:
+            vector = self._embed(question)
+            self._ensure_collection(len(vector))
+            hits = self._client.query_points(
+                self.collection, query=vector, limit=1, score_threshold=self.threshold, with_payload=True,
+            ).points
+        except Exception as e:
+            log.warning("Answer cache read failed: %s", e)
+            return None, None
+        if hits:
+            return hits[0].payload["answer"], vector
+        return None, vector
+
+    def set(self, question: str, answer: str, vector: list = None):
+        if self._client is None:
+            return
+        try:
+            if vector is None:
+                vector = self._embed(question)
+            self._ensure_collection(len(vector))
+            self._client.upsert(self.collection, points=[
+                models.PointStruct(id=str(uuid.uuid4()), vector=vector, payload={"question": question, "answer": answer}),
+            ])
+        except Exception as e:
+            log.warning("Answer cache write failed: %s", e)
+
+    def clear(self):
+        """Drops every stored answer, e.g. after the graph has been written to."""
+        if self._client is None:
+            return
+        try:
+            with self._lock:
+                self._client.delete_collection(self.collection)
+                self._ready = False
+        except Exception as e:
+            log.warning("Answer cache clear failed: %s", e)
+
+
+cache = AnswerCache()
@@ -1,123 +1,209 @@
-from flask import Flask, Response, json, jsonify, request, stream_with_context
+from flask import Flask, Response, jsonify, request, stream_with_context
 import os
+import atexit
+import logging
 import time
-import requests
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import hashlib
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
+from neo4j import READ_ACCESS
+from neo4j.time import Date, DateTime, Duration, Time
 from flask_cors import CORS
-from langgraph_agent import ask_agent, stream_agent_steps
+from langgraph_agent import ask_agent, stream_agent_steps, stream_agent_tokens
 import uuid
 from datetime import datetime
 from langsmith import Client
 from multi_agent_system import stream_multi_agent_steps
+import common
+from common import enrich_graph_steps
+from query_cache import cache as query_cache
+from answer_cache import cache as answer_cache
+from log_setup import queue_logging
 
 
 app = Flask(__name__)
 CORS(app)
 load_dotenv() 
-print("DEBUG: NEO4J_URI =", os.getenv("NEO4J_URI"))
-print("DEBUG: NEO4J_USER =", os.getenv("NEO4J_USER"))
-print("DEBUG: NEO4J_PASSWORD =", os.getenv("NEO4J_PASSWORD"))
-
-# Define Litellm variables here, as they are not dependent on Neo4j driver
-LITELLM_URL = os.getenv("LITELLM_BASE_URL").rstrip("/")
-LITELLM_KEY = os.getenv("LITELLM_API_KEY")
-MODEL = "gpt-4o"
-
-driver = None 
-try:
-    NEO4J_URI = os.getenv("NEO4J_URI")
-    NEO4J_USER = os.getenv("NEO4J_USER")
-    NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-
-    if not all([NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD]):
-        print("WARNING: Neo4j environment variables (NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD) not fully set. Database connection will likely fail.")
-    else:
-        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-        driver.verify_connectivity()
-        print("Neo4j driver initialized and connected successfully!")
-except Exception as e:
-    print(f"CRITICAL ERROR: Failed to initialize Neo4j driver: {e}")
-    driver = None 
-
-def call_agent(prompt: str) -> str:
-    payload = {
-        "model": MODEL,
-        "messages": [
-            {
-                "role": "user", "content": prompt
-            }
-        ]
-    }
-    headers = {
-        "Authorization": f"Bearer {LITELLM_KEY}",
-        "Content-Type": "application/json",
-    }
-    r = requests.post(f"{LITELLM_URL}/chat/completions", json=payload, headers=headers)
-    r.raise_for_status()
-    return r.json()["choices"][0]["message"]["content"]
 
-def enrich_graph():
-    if driver is None:
-        print("Cannot enrich graph: Neo4j driver is not available.")
-        return
+# Log records are handed to a queue on the request thread and written by a listener thread
+_log_handler, _log_listener = queue_logging(os.getenv("LOG_FORMAT", "text"))
+atexit.register(_log_listener.stop)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[_log_handler])
+log = logging.getLogger("app")
+
+# Connected only now, so the driver and schema logs go through the handlers configured above
+driver = common.init()
+
+# Background enrichment jobs, keyed by job_id (single-process only; use a task queue like Celery for multi-process deployments)
+EXECUTOR = ThreadPoolExecutor(max_workers=2)
+# Bounded like the other in-process caches: a job's status can be polled for a day, then it is dropped
+JOB_TTL = int(os.getenv("ENRICH_JOB_TTL", "86400"))
+JOBS = TTLCache(maxsize=256, ttl=JOB_TTL)
+_jobs_lock = threading.Lock()
+
+def _sse_event(step) -> bytes:
+    return b"data: " + orjson.dumps(step, default=str) + b"\n\n"
+
+SSE_FLUSH_BYTES = 256
+SSE_FLUSH_INTERVAL = 0.05
+_SSE_FINAL_STEPS = {"Final Answer", "Recommendation Complete", "Enrichment Complete", "Error"}
+
+SSE_QUEUE_SIZE = 64
+SSE_STEP_TIMEOUT = 30
+_SENTINEL = object()
 
-    with driver.session() as session:
-        result = session.run("""
-            MATCH (f1:Finding)-[:HAS_VULNERABILITY]->(v1:Vulnerability),
-                  (f2:Finding)-[:HAS_VULNERABILITY]->(v2:Vulnerability)
-            WHERE f1.id < f2.id AND v1.vector = v2.vector
-            RETURN f1.id AS id1, f2.id AS id2, v1.vector AS vector
-            LIMIT 5
-        """)
+def _bounded(steps, maxsize=SSE_QUEUE_SIZE, timeout=SSE_STEP_TIMEOUT, due=None):
+    """Runs the step generator in a worker thread behind a bounded queue, so a slow client backpressures the agent.
 
-        for record in result:
-            id1 = record["id1"]
-            id2 = record["id2"]
-            vector = record["vector"]
+    due() returns the seconds until the caller next needs control (None for no deadline); if no step
+    arrives by then, None is yielded in place of a step.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
 
-            prompt = f"""Given two findings:\n- {id1}\n- {id2}\nBoth have a vulnerability vector of '{vector}'. Do they likely share a root cause or attack pattern? Respond with either:\n\nYES - with a reason\nNO - and why not"""
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for step in steps:
+                if not put(step):
+                    break
+        except Exception as e:
+            log.error("Error in SSE producer: %s", e)
+            put({"step": "Error", "content": f"An error occurred: {e}"})
+        finally:
+            close = getattr(steps, "close", None)
+            if close:
+                close()
+            put(_SENTINEL)
 
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = deadline - time.monotonic()
+            caller_wait = due() if due else None
             try:
-                reply = call_agent(prompt)
-                print(f"Agent reply for {id1} and {id2}:\n{reply}\n")
-
-                if "yes" in reply.lower():
-                    session.run(
-                        """
-                        MATCH (f1:Finding {id: $id1}), (f2:Finding {id: $id2})
-                        MERGE (f1)-[:RELATED_TO {reason: $reason}]->(f2)
-                        """,
-                        id1=id1,
-                        id2=id2,
-                        reason=reply.strip(),
-                    )
-                    print(f"Linked {id1} <--> {id2}")
-                else:
-                    print(f"No link between {id1} <--> {id2}")
-            except Exception as e:
-                print(f"Error processing {id1} and {id2}: {e}")
-                time.sleep(1)
-
-def serialize_value(value):
+                step = q.get(timeout=max(0, wait if caller_wait is None else min(wait, caller_wait)))
+            except queue.Empty:
+                if time.monotonic() < deadline:
+                    yield None
+                    continue
+                yield {"step": "Error", "content": "Timed out waiting for the agent."}
+                break
+            if step is _SENTINEL:
+                break
+            deadline = time.monotonic() + timeout
+            yield step
+    finally:
+        # Client went away or stream finished: release a producer blocked on a full queue
+        stop.set()
+
+def _sse_stream(steps, timeout=SSE_STEP_TIMEOUT):
+    """Encodes steps as SSE frames, coalescing them into writes of ~SSE_FLUSH_BYTES or every SSE_FLUSH_INTERVAL seconds."""
+    buf = []
+    buf_size = 0
+    flush_at = None  # when the oldest buffered frame is due, even if no further step arrives
+
+    def due():
+        return None if flush_at is None else flush_at - time.monotonic()
+
+    for step in _bounded(steps, timeout=timeout, due=due):
+        if step is not None:
+            frame = _sse_event(step)
+            buf.append(frame)
+            buf_size += len(frame)
+            if flush_at is None:
+                flush_at = time.monotonic() + SSE_FLUSH_INTERVAL
+            if (buf_size < SSE_FLUSH_BYTES
+                    and time.monotonic() < flush_at
+                    and step.get("step") not in _SSE_FINAL_STEPS):
+                continue
+        # Reached on a full or final buffer, or when the flush timer expired with no new step
+        if buf:
+            yield b"".join(buf)
+            buf = []
+            buf_size = 0
+        flush_at = None
+    if buf:
+        yield b"".join(buf)
+
+# orjson encodes dict/list/str/number/datetime natively in C; this only sees the leftover neo4j types
+_JSON_DEFAULTS = {
+    DateTime: DateTime.iso_format,
+    Date: Date.iso_format,
+    Time: Time.iso_format,
+    Duration: Duration.iso_format,
+}
+
+def _json_default(value):
+    encode = _JSON_DEFAULTS.get(type(value))
+    if encode is not None:
+        return encode(value)
     if hasattr(value, "iso_format"):
         return value.iso_format()
-    if hasattr(value, "isoformat"):
-        return value.isoformat()
-    if isinstance(value, (list, tuple)):
-        return [serialize_value(v) for v in value]
-    if isinstance(value, dict):
-        return {k: serialize_value(v) for k, v in value.items()}
-    return value
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
 
 @app.route("/")
 def home():
     return jsonify({"message": "Hello, Flask!"})
 
+def _enrich_steps():
+    for step in enrich_graph_steps():
+        if step["step"] == "Enrichment Complete":
+            # New edges must show up on /graph and in agent queries before the client is told the run finished
+            invalidate_graph_cache()
+            query_cache.clear()
+            answer_cache.clear()
+        yield step
+
+def _enrich_job():
+    for _ in _enrich_steps():
+        pass
+
+# Judging reports each vector as it finishes, but one verdict can still wait on throttling and retries
+ENRICH_STEP_TIMEOUT = 300
+
 @app.route("/enrich-graph")
 def enrich_graph_route():
-    enrich_graph()
-    return jsonify({"message": "Graph enrichment process initiated. Check console for details."})
+    # SSE clients get per-pair progress on the open connection; everyone else gets a pollable job
+    if request.accept_mimetypes.best == "text/event-stream":
+        return Response(_sse_stream(_enrich_steps(), timeout=ENRICH_STEP_TIMEOUT), mimetype="text/event-stream")
+
+    job_id = str(uuid.uuid4())
+    future = EXECUTOR.submit(_enrich_job)
+    with _jobs_lock:
+        JOBS[job_id] = future
+    return jsonify({
+        "message": "Graph enrichment process initiated. Check console for details.",
+        "job_id": job_id,
+    }), 202
+
+@app.route("/enrich-graph/status/<job_id>")
+def enrich_graph_status(job_id):
+    with _jobs_lock:
+        future = JOBS.get(job_id)
+    if future is None:
+        return jsonify({"error": "Unknown job_id"}), 404
+    error = future.exception() if future.done() else None
+    return jsonify({
+        "job_id": job_id,
+        "done": future.done(),
+        "error": str(error) if error else None,
+    })
 
 @app.route("/chat", methods=["POST"])
 def chat():
@@ -126,12 +212,16 @@ def chat():
     if not user_msg:
         return jsonify({"error": "Message is required"}), 400
 
+    # Opt-in token streaming: the first words reach the client while the model is still generating
+    if data.get("stream"):
+        return Response(_sse_stream(stream_agent_tokens(user_msg, db_driver=driver)), mimetype="text/event-stream")
+
     try:
         reply = ask_agent(user_msg, db_driver=driver)
-        print(f"Agent reply: {reply}")
+        log.debug("Agent reply: %s", reply)
         return jsonify({"response": reply})
     except Exception as e:
-        print(f"Error in /chat endpoint: {e}")
+        log.error("Error in /chat endpoint: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/chat/stream", methods=["POST"])
@@ -139,27 +229,60 @@ def chat_stream():
     data = request.json
     user_msg = data.get("message")
     request_trace_id = str(uuid.uuid4())
-    print(f"New incoming request with external_trace_id: {request_trace_id}")
+    log.info("New incoming request with external_trace_id: %s", request_trace_id)
 
-    def generate():
-        for chunk in stream_agent_steps(user_msg, db_driver=driver, external_trace_id=request_trace_id):
-            yield f"data: {json.dumps(chunk)}\n\n"
-
-    return Response(generate(), mimetype="text/event-stream")
+    steps = stream_agent_steps(user_msg, db_driver=driver, external_trace_id=request_trace_id)
+    return Response(_sse_stream(steps), mimetype="text/event-stream")
 
 @app.route("/chat/multi-agent/stream", methods=["POST"])
 def chat_multi_agent_stream():
     data = request.json
     user_msg = data.get("message")
     request_trace_id = str(uuid.uuid4())
-    print(f"New multi-agent request with external_trace_id: {request_trace_id}")
-    print(f"---DEBUG: db_driver available: {driver is not None}---")
+    log.info("New multi-agent request with external_trace_id: %s", request_trace_id)
+    log.debug("db_driver available: %s", driver is not None)
+
+    steps = stream_multi_agent_steps(user_msg, db_driver=driver, external_trace_id=request_trace_id)
+    return Response(_sse_stream(steps), mimetype="text/event-stream")
+
+# Finished traces never change, so their shaped rows can be served from memory
+_trace_cache = TTLCache(maxsize=512, ttl=60)
+_trace_cache_lock = threading.Lock()
+
+_langsmith = None
+_langsmith_lock = threading.Lock()
 
-    def generate():
-        for chunk in stream_multi_agent_steps(user_msg, db_driver=driver, external_trace_id=request_trace_id):
-            yield f"data: {json.dumps(chunk)}\n\n"
+def _langsmith_client(api_key: str) -> Client:
+    # Client owns a requests.Session; build it once and share it across requests
+    global _langsmith
+    if _langsmith is None:
+        with _langsmith_lock:
+            if _langsmith is None:
+                _langsmith = Client(api_key=api_key)
+    return _langsmith
 
-    return Response(generate(), mimetype="text/event-stream")
+def _trace_row(run, trace_id):
+    inputs = run.inputs if run.inputs else {}
+    outputs = run.outputs if run.outputs else {}
+    if outputs.get("output"):
+        content = outputs["output"]
+    elif outputs:
+        content = str(outputs)
+    elif inputs:
+        content = str(inputs)
+    else:
+        content = "(no content)"
+    return {
+        "step": run.name,
+        "run_type": getattr(run, "run_type", ""),
+        "inputs": inputs,
+        "outputs": outputs,
+        "content": content,
+        "trace_id": run.id,
+        "external_trace_id": trace_id,
+        "start_time": str(getattr(run, "start_time", "")),
+        "end_time": str(getattr(run, "end_time", "")),
+    }
 
 @app.route("/trace/<trace_id>")
 def get_trace(trace_id):
@@ -167,90 +290,89 @@ def get_trace(trace_id):
     if not api_key:
         return jsonify({"error": "LANGCHAIN_API_KEY not set"}), 500
 
+    with _trace_cache_lock:
+        payload = _trace_cache.get(trace_id)
+    if payload is not None:
+        return Response(payload, mimetype="application/json")
+
     try:
-        client = Client(api_key=api_key)
-        runs = list(client.list_runs(trace_id=trace_id))
+        client = _langsmith_client(api_key)
         steps = []
-        for run in runs:
-            inputs = run.inputs if run.inputs else {}
-            outputs = run.outputs if run.outputs else {}
-            if outputs.get("output"):
-                content = outputs["output"]
-            elif outputs:
-                content = str(outputs)
-            elif inputs:
-                content = str(inputs)
-            else:
-                content = "(no content)"
-            steps.append({
-                "step": run.name,
-                "run_type": getattr(run, "run_type", ""),
-                "inputs": inputs,
-                "outputs": outputs,
-                "content": content,
-                "trace_id": run.id,
-                "external_trace_id": trace_id,
-                "start_time": str(getattr(run, "start_time", "")),
-                "end_time": str(getattr(run, "end_time", "")),
-            })
-        return jsonify(steps)
+        finished = True
+        # Shape runs as the paginated iterator yields them instead of materializing the full list first
+        for run in client.list_runs(trace_id=trace_id):
+            steps.append(_trace_row(run, trace_id))
+            finished = finished and getattr(run, "end_time", None) is not None
+        payload = orjson.dumps(steps, default=str)
+        if steps and finished:
+            with _trace_cache_lock:
+                _trace_cache[trace_id] = payload
+        return Response(payload, mimetype="application/json")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Shapes nodes/links in Cypher so /graph is one round-trip with no per-record Python rebuild
+GRAPH_QUERY = """
+    MATCH (n)
+    OPTIONAL MATCH (n)-[r]->(m)
+    WHERE type(r) <> 'NOT_RELATED'
+    WITH n, r, m
+    LIMIT 100
+    WITH collect(n) + collect(m) AS ns, collect(r) AS rs
+    UNWIND ns AS node
+    WITH DISTINCT node, rs
+    WITH rs, collect({
+        id: toString(id(node)),
+        label: coalesce(node.title, node.id, head(labels(node)), 'Node'),
+        group: coalesce(head(labels(node)), 'Node'),
+        properties: properties(node)
+    }) AS nodes
+    RETURN nodes, [rel IN rs | {
+        source: toString(id(startNode(rel))),
+        target: toString(id(endNode(rel))),
+        type: type(rel),
+        properties: properties(rel)
+    }] AS links
+"""
+
+GRAPH_CACHE_TTL = 10
+_graph_cache = TTLCache(maxsize=1, ttl=GRAPH_CACHE_TTL)
+_graph_cache_lock = threading.Lock()
+
+def _read_graph(tx):
+    return tx.run(GRAPH_QUERY).single()
+
+def _build_graph_payload() -> bytes:
+    # Managed read transaction: retried on transient cluster errors and routable to a read replica
+    with driver.session(default_access_mode=READ_ACCESS) as session:
+        record = session.execute_read(_read_graph)
+    graph = {"nodes": record["nodes"], "links": record["links"]} if record else {"nodes": [], "links": []}
+    return orjson.dumps(graph, default=_json_default, option=orjson.OPT_NAIVE_UTC)
+
+def invalidate_graph_cache():
+    with _graph_cache_lock:
+        _graph_cache.clear()
+
 @app.route("/graph")
 def get_graph():
     if driver is None:
         return jsonify({"error": "Neo4j driver not available"}), 500
 
     try:
-        with driver.session() as session:
-            result = session.run("""
-                MATCH (n)
-                OPTIONAL MATCH (n)-[r]->(m)
-                RETURN n, r, m
-                LIMIT 100
-            """)
-            nodes = {}
-            links = []
-            for record in result:
-                n = record["n"]
-                m = record["m"]
-                r = record["r"]
-
-                def get_first_label(node):
-                    return list(node.labels)[0] if node and node.labels else "Node"
-
-                if n:
-                    node_id = str(n.id)
-                    if node_id not in nodes:
-                        nodes[node_id] = {
-                            "id": node_id,
-                            "label": n.get("title") or n.get("id") or get_first_label(n),
-                            "group": get_first_label(n),
-                            "properties": {k: serialize_value(v) for k, v in dict(n).items()}
-                        }
-                if m:
-                    node_id = str(m.id)
-                    if node_id not in nodes:
-                        nodes[node_id] = {
-                            "id": node_id,
-                            "label": m.get("title") or m.get("id") or get_first_label(m),
-                            "group": get_first_label(m),
-                            "properties": {k: serialize_value(v) for k, v in dict(m).items()}
-                        }
-                if r and n and m:
-                    links.append({
-                        "source": str(n.id),
-                        "target": str(m.id),
-                        "type": r.type,
-                        "properties": {k: serialize_value(v) for k, v in dict(r).items()}
-                    })
-            return jsonify({
-                "nodes": list(nodes.values()),
-                "links": links
-            })
+        with _graph_cache_lock:
+            payload = _graph_cache.get("graph")
+        if payload is None:
+            payload = _build_graph_payload()
+            with _graph_cache_lock:
+                _graph_cache["graph"] = payload
+
+        etag = '"' + hashlib.blake2b(payload, digest_size=16).hexdigest() + '"'
+        headers = {"ETag": etag, "Cache-Control": f"max-age={GRAPH_CACHE_TTL}"}
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status=304, headers=headers)
+        return Response(payload, mimetype="application/json", headers=headers)
     except Exception as e:
-        print("Error in /graph:", e)
+        log.error("Error in /graph: %s", e)
         return jsonify({"error": str(e)}), 500
     
 if __name__ == "__main__":
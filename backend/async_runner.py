@@ -0,0 +1,63 @@
+import asyncio
+import functools
+import threading
+
+import httpx
+
+# Optional, and only for scripts that own their loop (new_runner): the shared loop below must stay a
+# stdlib loop, which gevent's monkey-patching makes cooperative under gunicorn; uvloop's is not
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# One long-lived event loop per process, on a daemon thread. The async agent graphs run
+# here so sync callers (Flask routes, test scripts) can drive them, and loop-bound state
+# such as ChatOpenAI's async HTTP pool is reused across requests instead of rebuilt per call.
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-runner", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run(coro):
+    """Runs a coroutine on the shared loop and blocks until it returns."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+def iterate(agen):
+    """Drives an async generator on the shared loop, yielding its items synchronously."""
+    loop = _get_loop()
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        # Consumer stopped early (client disconnected): let the generator clean up on its loop
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
+
+def new_runner() -> asyncio.Runner:
+    """A Runner for scripts that own their loop (asyncio.run's counterpart), on uvloop when installed."""
+    return asyncio.Runner(loop_factory=uvloop.new_event_loop if uvloop is not None else None)
+
+
+@functools.cache
+def http_client() -> httpx.AsyncClient:
+    """One pooled async HTTP client for every ChatOpenAI in the process (both agents, all models).
+
+    Only used from coroutines on the shared loop, so its keep-alive connections stay on one loop.
+    """
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
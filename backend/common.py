@@ -0,0 +1,306 @@
+# Shared by app.py (HTTP routes) and enrich_graph.py (CLI), so both entry points
+# use one Neo4j driver pool, one LiteLLM client setup and one enrichment pipeline.
+import os
+import atexit
+import logging
+from functools import lru_cache
+from collections import defaultdict
+import asyncio
+import contextlib
+import httpx
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+import orjson
+from dotenv import load_dotenv
+from neo4j import READ_ACCESS, AsyncGraphDatabase, GraphDatabase
+from llm_cache import agent_cache, cache as llm_cache, cache_key
+from rate_limit import Throttle, estimate_tokens
+import async_runner
+
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+# Define Litellm variables here, as they are not dependent on Neo4j driver
+LITELLM_URL = (os.getenv("LITELLM_BASE_URL") or "").rstrip("/")
+LITELLM_KEY = os.getenv("LITELLM_API_KEY")
+MODEL = "gpt-4o"
+COMPLETIONS_URL = f"{LITELLM_URL}/chat/completions"
+
+_HEADERS = {
+    "Authorization": f"Bearer {LITELLM_KEY}",
+    "Content-Type": "application/json",
+}
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Caps in-flight LiteLLM requests per enrichment run to stay under the provider rate limit
+LITELLM_MAX_CONCURRENCY = int(os.getenv("LITELLM_MAX_CONCURRENCY", "4"))
+
+def _litellm_client() -> httpx.AsyncClient:
+    # One pooled client per enrichment run, so every LLM call in the run reuses the same TCP/TLS connections
+    limits = httpx.Limits(max_connections=64, max_keepalive_connections=16)
+    return httpx.AsyncClient(
+        headers=_HEADERS,
+        timeout=httpx.Timeout(20, connect=3.05),
+        transport=httpx.AsyncHTTPTransport(retries=3, limits=limits),
+    )
+
+def _is_retryable(exc: BaseException) -> bool:
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code in _RETRY_STATUSES
+
+# NEO4J_POOL_SIZE is the process's whole Bolt connection budget. It is split between the sync driver
+# (HTTP routes, the single agent, enrichment) and the async one (multi-agent tools), so the two pools
+# together never open more connections than that
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+_DRIVER_SETTINGS = {
+    "max_connection_pool_size": max(1, NEO4J_POOL_SIZE // 2),
+    # Fail fast when the pool is exhausted instead of queueing requests behind slow queries
+    "connection_acquisition_timeout": float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "5")),
+    "max_connection_lifetime": 3600,
+}
+
+NEO4J_URI = os.getenv("NEO4J_URI")
+NEO4J_USER = os.getenv("NEO4J_USER")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+
+# Set by init(); importing this module opens no connections and runs no DDL
+driver = None
+
+def init(schema: bool = True):
+    """Connects the process-wide driver (once) and, if schema is set, ensures the indexes exist.
+
+    Called by the entry points after they configure logging, so the connection logs reach their handlers.
+    """
+    global driver
+    if driver is not None:
+        return driver
+    log.debug("NEO4J_URI = %s", NEO4J_URI)
+    log.debug("NEO4J_USER = %s", NEO4J_USER)
+    try:
+        if not all([NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD]):
+            log.warning("Neo4j environment variables (NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD) not fully set. Database connection will likely fail.")
+            return None
+        # One process-wide driver owns the Bolt connection pool; requests only open sessions
+        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), **_DRIVER_SETTINGS)
+        driver.verify_connectivity()
+        atexit.register(driver.close)
+        log.info("Neo4j driver initialized and connected successfully!")
+    except Exception as e:
+        log.critical("Failed to initialize Neo4j driver: %s", e)
+        driver = None
+        return None
+    if schema:
+        ensure_schema()
+    return driver
+
+_async_driver = None
+
+def get_async_driver():
+    """Async driver for code on the async_runner loop, built on first use with the same pool settings.
+
+    Async connections are bound to the loop that opened them, so this must only be awaited on that one loop.
+    Returns None until init() has connected the sync driver, and is retried on the next call.
+    """
+    global _async_driver
+    if _async_driver is None and driver is not None:
+        _async_driver = AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), **_DRIVER_SETTINGS)
+    return _async_driver
+
+SCHEMA_STATEMENTS = [
+    "CREATE INDEX vuln_vector IF NOT EXISTS FOR (v:Vulnerability) ON (v.vector)",
+    "CREATE CONSTRAINT finding_id_unique IF NOT EXISTS FOR (f:Finding) REQUIRE f.id IS UNIQUE",
+    # Lets the temporal tool query read timestamps from the index instead of scanning Finding nodes
+    "CREATE INDEX finding_ts IF NOT EXISTS FOR (f:Finding) ON (f.timestamp)",
+]
+
+def ensure_schema():
+    if driver is None:
+        return
+    try:
+        with driver.session() as session:
+            for statement in SCHEMA_STATEMENTS:
+                session.run(statement).consume()
+        log.info("Neo4j indexes and constraints ensured.")
+    except Exception as e:
+        log.warning("Failed to ensure Neo4j schema: %s", e)
+
+# Static instructions go first so the provider can reuse the prompt prefix;
+# only the per-pair details are sent in the user turn.
+ENRICH_SYSTEM_PROMPT = """You compare pairs of security findings from a vulnerability knowledge graph.
+You are given the vulnerability vector that two findings share.
+Decide whether findings with that shared vector likely share a root cause or attack pattern.
+Respond with JSON: {"related": true|false, "reason": "..."}"""
+
+# The judgement only depends on the shared vector, so it is asked once per vector, not once per pair
+ENRICH_PROMPT_TEMPLATE = "Two findings share the vulnerability vector '{vector}'. Do they likely share a root cause? Give a reason."
+
+@lru_cache(maxsize=8)
+def _system_message(content: str) -> dict:
+    # OpenAI caches long prefixes automatically; Anthropic (via LiteLLM) needs an explicit marker
+    if MODEL.startswith(("claude", "anthropic/")):
+        return {
+            "role": "system",
+            "content": [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}],
+        }
+    return {"role": "system", "content": content}
+
+async def call_agent(client: httpx.AsyncClient, prompt: str, system: str = None,
+                     semaphore: asyncio.Semaphore = None, throttle: Throttle = None) -> str:
+    user_message = {"role": "user", "content": prompt}
+    messages = [_system_message(system), user_message] if system else [user_message]
+    key = cache_key(MODEL, messages)
+    # Exact matches only: enrichment prompts differ by just the vector name ('SQL Injection' vs
+    # 'Blind SQL Injection'), and a near-duplicate's verdict would be written to the graph as an edge
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Structured output gives a reliable boolean and keeps the reply to a sentence or two
+    payload = {
+        "model": MODEL,
+        "messages": messages,
+        "max_tokens": 128,
+        "response_format": {"type": "json_object"},
+    }
+    estimated = estimate_tokens((system or "") + prompt, payload["max_tokens"])
+    # The throttle paces requests under the RPM/TPM caps; retries only cover what still slips through
+    async for attempt in AsyncRetrying(
+        retry=retry_if_exception(_is_retryable),
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(3),
+        reraise=True,
+    ):
+        with attempt:
+            async with semaphore or contextlib.nullcontext():
+                if throttle is not None:
+                    await throttle.acquire(estimated)
+                r = await client.post(COMPLETIONS_URL, json=payload)
+            r.raise_for_status()
+    body = orjson.loads(r.content)
+    if throttle is not None:
+        throttle.record(body.get("usage", {}).get("total_tokens", estimated))
+    reply = body["choices"][0]["message"]["content"]
+    llm_cache.set(key, reply)
+    return reply
+
+LINK_BATCH_SIZE = 500
+
+def _link_findings(tx, rows):
+    tx.run(
+        """
+        UNWIND $rows AS r
+        MATCH (f1:Finding {id: r.id1}), (f2:Finding {id: r.id2})
+        MERGE (f1)-[rel:RELATED_TO]->(f2)
+        SET rel.reason = r.reason
+        """,
+        rows=rows,
+    )
+
+def _mark_unrelated(tx, rows):
+    tx.run(
+        """
+        UNWIND $rows AS r
+        MATCH (f1:Finding {id: r.id1}), (f2:Finding {id: r.id2})
+        MERGE (f1)-[rel:NOT_RELATED]->(f2)
+        SET rel.reason = r.reason
+        """,
+        rows=rows,
+    )
+
+async def _judge_vector(client, vector, semaphore, throttle):
+    prompt = ENRICH_PROMPT_TEMPLATE.format(vector=vector)
+    try:
+        reply = await call_agent(client, prompt, system=ENRICH_SYSTEM_PROMPT, semaphore=semaphore, throttle=throttle)
+        log.info("Agent reply for vector %s:\n%s", vector, reply)
+        verdict = orjson.loads(reply)
+        return verdict.get("related") is True, str(verdict.get("reason", "")).strip()
+    except Exception as e:
+        log.error("Error processing vector %s: %s", vector, e)
+    return None
+
+async def _judge_vectors(vectors):
+    """Judges every vector concurrently, yielding (vector, verdict) as each call finishes."""
+    semaphore = asyncio.Semaphore(LITELLM_MAX_CONCURRENCY)
+    throttle = Throttle()
+    async with _litellm_client() as client:
+        async def judge(vector):
+            return vector, await _judge_vector(client, vector, semaphore, throttle)
+
+        tasks = [asyncio.ensure_future(judge(v)) for v in vectors]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Consumer went away early: don't leave calls running against a closed client
+            for task in tasks:
+                task.cancel()
+
+# Group findings by vector in one pass, then pair within each group,
+# instead of expanding every Finding x Finding combination
+CANDIDATE_PAIRS_QUERY = """
+    MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability)
+    WHERE v.vector IS NOT NULL
+    WITH v.vector AS vector, collect(DISTINCT f.id) AS ids
+    WHERE size(ids) > 1
+    UNWIND ids AS id1
+    UNWIND ids AS id2
+    WITH id1, id2, vector
+    WHERE id1 < id2
+    MATCH (f1:Finding {id: id1}), (f2:Finding {id: id2})
+    // Pairs judged on a previous run are skipped, so re-runs don't call the LLM again
+    WHERE NOT (f1)-[:RELATED_TO|NOT_RELATED]-(f2)
+    RETURN id1, id2, vector
+    LIMIT 5
+"""
+
+def _candidate_pairs(tx):
+    return [record.data() for record in tx.run(CANDIDATE_PAIRS_QUERY)]
+
+def enrich_graph():
+    for _ in enrich_graph_steps():
+        pass
+
+def enrich_graph_steps():
+    """Runs one enrichment pass, yielding a progress event per judged pair and a summary at the end."""
+    if driver is None:
+        log.error("Cannot enrich graph: Neo4j driver is not available.")
+        yield {"step": "Error", "content": "Neo4j driver is not available."}
+        return
+
+    with driver.session(default_access_mode=READ_ACCESS) as session:
+        pairs = session.execute_read(_candidate_pairs)
+
+    pairs_by_vector = defaultdict(list)
+    for pair in pairs:
+        pairs_by_vector[pair["vector"]].append(pair)
+
+    yield {"step": "Judging", "pairs": len(pairs), "vectors": len(pairs_by_vector)}
+    # All LLM calls are I/O-bound, so they are dispatched concurrently on the shared loop;
+    # each vector's pairs are reported as soon as its verdict is in
+    rows = []
+    unrelated = []
+    for vector, verdict in async_runner.iterate(_judge_vectors(list(pairs_by_vector))):
+        if verdict is None:
+            # Failed or unparseable calls are left unmarked so the pair is retried on the next run
+            continue
+        related, reason = verdict
+        for pair in pairs_by_vector[vector]:
+            row = {"id1": pair["id1"], "id2": pair["id2"], "reason": reason}
+            if related:
+                log.info("Linked %s <--> %s", pair["id1"], pair["id2"])
+                rows.append(row)
+            else:
+                log.info("No link between %s <--> %s", pair["id1"], pair["id2"])
+                unrelated.append(row)
+            yield {"step": "Pair", "pair": [pair["id1"], pair["id2"]], "linked": related}
+
+    # All links go out in as few UNWIND transactions as possible
+    with driver.session() as session:
+        for i in range(0, len(rows), LINK_BATCH_SIZE):
+            session.execute_write(_link_findings, rows[i:i + LINK_BATCH_SIZE])
+        for i in range(0, len(unrelated), LINK_BATCH_SIZE):
+            session.execute_write(_mark_unrelated, unrelated[i:i + LINK_BATCH_SIZE])
+    if rows or unrelated:
+        # Cached agent turns may have been decided on the old edges
+        agent_cache.clear()
+
+    log.info("LLM cache stats: %s", llm_cache.stats())
+    yield {"step": "Enrichment Complete", "linked": len(rows), "unrelated": len(unrelated)}
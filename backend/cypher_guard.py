@@ -0,0 +1,50 @@
+import re
+
+# Validation for Cypher written by the model, applied before anything reaches Neo4j. A bad
+# query is rejected in microseconds here instead of tying up a Bolt session and pool slot.
+_READ_SHAPE = re.compile(r"^\s*(?:OPTIONAL\s+)?MATCH\b.*\bRETURN\b", re.IGNORECASE | re.DOTALL)
+
+FORBIDDEN_CLAUSES = ("CREATE", "MERGE", "DELETE", "DETACH", "SET", "REMOVE", "DROP", "CALL", "LOAD", "FOREACH")
+# One alternation, so the query is scanned once regardless of how many clauses are forbidden
+_FORBIDDEN = re.compile(r"\b(?:" + "|".join(FORBIDDEN_CLAUSES) + r")\b", re.IGNORECASE)
+
+# String literals, backtick-quoted names and comments can hold any word ('Header Not Set',
+# 'Set-Cookie'), so they are blanked out before the shape and keyword checks
+_NOT_CODE = re.compile(
+    r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|//[^\n]*|/\*.*?\*/",
+    re.DOTALL,
+)
+
+
+# The same words are valid names in a read query (RETURN n.name AS set, n.delete, {set: 1}, (set:Finding),
+# $set): a keyword only counts when it is not written where a name goes
+_NAME_BEFORE = re.compile(r"(?:[.:$(\[]|\bAS)\s*$", re.IGNORECASE)
+_NAME_AFTER = re.compile(r"\s*(?:[.:,)\]}=<>]|$)")
+
+
+def _code(query: str) -> str:
+    return _NOT_CODE.sub(" _ ", query)
+
+
+def _clause(code: str):
+    for match in _FORBIDDEN.finditer(code):
+        if _NAME_BEFORE.search(code, 0, match.start()) or _NAME_AFTER.match(code, match.end()):
+            continue
+        return match.group(0).upper()
+    return None
+
+
+def forbidden_clause(query: str):
+    """Returns the first write or procedure clause in the query (outside literals and comments), else None."""
+    return _clause(_code(query))
+
+
+def check_cypher(query: str):
+    """Returns an error message if the query is not a plain MATCH ... RETURN read, else None."""
+    code = _code(query)
+    if not _READ_SHAPE.match(code):
+        return "Error: only read queries of the form MATCH ... RETURN ... are allowed."
+    forbidden = _clause(code)
+    if forbidden:
+        return f"Error: the {forbidden} clause is not allowed in queries."
+    return None
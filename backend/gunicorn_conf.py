@@ -0,0 +1,20 @@
+# Gunicorn settings for serving app.py in production:
+#   gunicorn -c gunicorn_conf.py app:app
+#
+# Long-lived SSE streams (/chat/stream, /chat/multi-agent/stream) would each pin a
+# thread on the Flask dev server. gevent workers run every request as a greenlet,
+# so one worker can hold many open streams while other endpoints stay responsive.
+# The gevent worker monkey-patches the stdlib before app.py is imported, which
+# makes requests, the Neo4j driver and our worker threads cooperative.
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", "1000"))
+keepalive = 5
+# Recycles a worker whose event loop stops heartbeating (e.g. a CPU-bound call that never yields);
+# open SSE streams are not affected since idle greenlets keep the heartbeat alive
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+accesslog = "-"
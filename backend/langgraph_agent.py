@@ -1,32 +1,57 @@
 import os
-from typing import TypedDict, Annotated, Any
-from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage, AIMessage
+import asyncio
+import functools
+import hashlib
+from typing import TypedDict, Annotated
+from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage, AIMessage, message_to_dict, messages_from_dict, messages_to_dict
 from langgraph.graph import StateGraph, END
 from langchain_core.tools import tool
 from langchain_openai import ChatOpenAI
 from langchain_core.tracers.context import collect_runs
 from dotenv import load_dotenv
-import json
-from neo4j import GraphDatabase
+import logging
+import orjson
+from langchain_core.runnables import RunnableConfig
+from langchain_core.utils.function_calling import convert_to_openai_tool
 import time
 import uuid
-from datetime import datetime, date
+from datetime import datetime
+import async_runner
+from llm_cache import agent_cache, cache_key
+from query_cache import cache as query_cache, cacheable
+from cypher_guard import check_cypher
+from neo4j_query import (
+    READ_SESSION, NO_RESULTS, TIMEOUT_MESSAGE, query_ids, bounded_records, encode_records, is_timeout,
+)
+from answer_cache import cache as answer_cache
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+MODEL = "gpt-4o"
+# The opening turn mostly just picks a tool; the turns that read tool output and write the answer use MODEL
+ROUTER_MODEL = os.getenv("AGENT_ROUTER_MODEL", "gpt-4o-mini")
+# Fixed rather than the provider default, so a cached turn is a reply the model would give again
+TEMPERATURE = 0
+
 # --- Tools ---
 @tool   
 def explain_vector(vector: str) -> str:
     """Explains typical root causes or attack patterns for a specific vulnerability vector. Use this tool when the user asks about 'code', 'network', or 'config' vulnerabilities."""
-    print(f"---CALLING TOOL: explain_vector with vector: {vector}---")
+    log.debug("Calling tool explain_vector with vector: %s", vector)
     return {
         "code": "Code issue: This typically involves input validation errors, the use of insecure libraries, or general logic flaws in the application code.",
         "network": "Network issue: This often points to exposed ports, misconfigured firewalls, or weak network segmentation that allows for unauthorized access.",
         "config": "Configuration issue: This is usually caused by default credentials, unsafe file permissions, or improperly configured logging and monitoring.",
     }.get(vector.lower(), "Unknown vector. Valid options are 'code', 'network', or 'config'.")
 
+def _read_bounded(db_driver, query):
+    with db_driver.session(**READ_SESSION) as session:
+        return session.execute_read(bounded_records, query)
+
 @tool
-def query_neo4j(query: str, db_driver: Any = None) -> str:
+async def query_neo4j(query: str, config: RunnableConfig) -> str:
     """
     Executes a Cypher query against the Neo4j database and returns the results.
     Use this tool to retrieve information about findings, vulnerabilities, or relationships
@@ -34,94 +59,97 @@ def query_neo4j(query: str, db_driver: Any = None) -> str:
     The query should be a valid Cypher query string.
     Example: MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability) RETURN f.id, v.title LIMIT 5
     """
-    query_id = str(uuid.uuid4())[:8]
+    query_id = f"{next(query_ids):08x}"
     start_time = time.time()
+    # Injected from the run config rather than exposed as a tool argument the model has to emit
+    db_driver = config.get("configurable", {}).get("db_driver")
     
-    def serialize_value(value):
-        if isinstance(value, (datetime, date)):
-            return value.isoformat()
-        if isinstance(value, dict):
-            return {k: serialize_value(v) for k, v in value.items()}
-        if isinstance(value, list):
-            return [serialize_value(v) for v in value]
-        return value
-    
-    print(f"---CALLING TOOL: query_neo4j with query: {query}---")
+    log.debug("Calling tool query_neo4j with query: %s", query)
     if db_driver is None:
         return "Error: Neo4j database driver not provided to tool."
 
+    # Model-written Cypher is checked before it can hold a session
+    rejected = check_cypher(query)
+    if rejected:
+        log.debug("query_rejected", extra={"query_id": query_id})
+        return rejected
+
+    use_cache = cacheable(query)
+    if use_cache:
+        cached = query_cache.get(query)
+        if cached is not None:
+            log.debug("query_cache_hit", extra={"query_id": query_id})
+            return cached
+
     try:
-        with db_driver.session() as session:
-            print(f"---DEBUG: query: {query}---")
-            print(f"---DEBUG: db_driver: {db_driver}---")
-            print(f"---DEBUG: session: {session}---")
-            result = session.run(query)
-            records = [serialize_value(record.data()) for record in result]
-        if records:
+        # The sync driver is shared process-wide (one pool); its blocking read runs off the event loop
+        records, truncated = await asyncio.to_thread(_read_bounded, db_driver, query)
+        # A truncated result always goes back with its note, never as "no results"
+        if records or truncated:
             duration = time.time() - start_time
-            print(f"[QUERY-{query_id}] Completed in {duration:.3f}s")
-            return json.dumps(records, indent=2)
+            log.debug("query_complete", extra={"query_id": query_id, "duration_ms": int(duration * 1000), "rows": len(records)})
+            payload = encode_records(records, truncated)
+            if use_cache:
+                query_cache.set(query, payload)
+            return payload
         else:
             duration = time.time() - start_time
-            print(f"[QUERY-{query_id}] No results in {duration:.3f}s")
-            return "No results found for the query."
+            log.debug("query_empty", extra={"query_id": query_id, "duration_ms": int(duration * 1000)})
+            return NO_RESULTS
     except Exception as e:
         duration = time.time() - start_time
-        print(f"[QUERY-{query_id}] Error in 0.065s: {e}") # Corrected duration here based on your log
+        if is_timeout(e):
+            log.warning("query_timeout", extra={"query_id": query_id, "duration_ms": int(duration * 1000)})
+            return TIMEOUT_MESSAGE
+        log.warning("query_error %s", e, extra={"query_id": query_id, "duration_ms": int(duration * 1000)})
         return f"Error executing Neo4j query: {e}"
 
 # --- Agent State ---
 class AgentState(TypedDict):
     messages: Annotated[list[AnyMessage], lambda x, y: x + y]
-    db_driver: Any
     trace_id: str
     user_id: str
     timestamp: str
 
 # --- Agent Nodes ---
-def call_model(state: AgentState):
+async def call_model(state: AgentState):
     """Calls the LLM with the current state of messages."""
-    print("---CALLING MODEL---")
-    response = llm_with_tools.invoke(state["messages"])
+    model = MODEL if isinstance(state["messages"][-1], ToolMessage) else ROUTER_MODEL
+    log.debug("Calling model %s", model)
+    # Identical conversations (same question, same tool results) reuse the stored reply; the key also
+    # covers the sampling settings and tool schemas, so changing either never replays an old decision
+    key = cache_key(model, messages_to_dict(state["messages"]), TEMPERATURE, _TOOL_SCHEMAS_DIGEST)
+    cached = agent_cache.get(key)
+    if cached is not None:
+        return {"messages": messages_from_dict([cached])}
+    response = await _llm(model).ainvoke(state["messages"])
+    agent_cache.set(key, message_to_dict(response))
     return {"messages": [response]}
 
-def call_tool(state: AgentState, config: dict):
+_TOOLS = {"explain_vector": explain_vector, "query_neo4j": query_neo4j}
+# Converted to OpenAI tool schemas once at import; every per-model client binds these same dicts
+_TOOL_SCHEMAS = [convert_to_openai_tool(t) for t in _TOOLS.values()]
+_TOOL_SCHEMAS_DIGEST = hashlib.sha256(orjson.dumps(_TOOL_SCHEMAS, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+async def _invoke_tool(tool_call, config):
+    tool_name, args, tool_call_id = tool_call["name"], tool_call["args"], tool_call["id"]
+    log.debug("Executing tool %s", tool_name)
+    tool_fn = _TOOLS.get(tool_name)
+    if tool_fn is None:
+        return ToolMessage(content=f"Unknown tool: {tool_name}", tool_call_id=tool_call_id)
+    try:
+        # The driver rides in the run config, not the state or the args; query_neo4j reads it from there
+        tool_output = await tool_fn.ainvoke(args, config=config)
+        return ToolMessage(content=str(tool_output), tool_call_id=tool_call_id)
+    except Exception as e:
+        return ToolMessage(content=f"Error executing tool {tool_name}: {e}", tool_call_id=tool_call_id)
+
+async def call_tool(state: AgentState, config: dict):
     """Executes tools based on the model's last response."""
-    last_message = state["messages"][-1]
-    tool_outputs = []
-    db_driver = state.get("db_driver")
-    print(f"---DEBUG: db_driver in config: {db_driver is not None}---")
-
-    for tool_call in last_message.tool_calls:
-        tool_name = tool_call["name"]
-        print(f"---EXECUTING TOOL: {tool_name}---")
-        try:
-            if tool_name == "explain_vector":
-                tool_output = explain_vector.invoke(tool_call["args"])
-                tool_outputs.append(
-                    ToolMessage(content=str(tool_output), tool_call_id=tool_call["id"])
-                )
-            elif tool_name == "query_neo4j":
-                if db_driver:
-                    tool_args = tool_call["args"].copy()
-                    tool_args["db_driver"] = db_driver
-                    tool_output = query_neo4j.invoke(tool_args)
-                    tool_outputs.append(
-                        ToolMessage(content=str(tool_output), tool_call_id=tool_call["id"])
-                    )
-                else:
-                    tool_outputs.append(
-                        ToolMessage(content="Error: Neo4j driver not available in config.", tool_call_id=tool_call["id"])
-                    )
-            else:
-                tool_outputs.append(
-                    ToolMessage(content=f"Unknown tool: {tool_name}", tool_call_id=tool_call["id"])
-                )
-        except Exception as e:
-            tool_outputs.append(
-                ToolMessage(content=f"Error executing tool {tool_name}: {e}", tool_call_id=tool_call["id"])
-            )
-    return {"messages": tool_outputs}
+    # Parallel tool calls from one turn are independent reads, so they run concurrently;
+    # gather keeps the ToolMessages in tool_call order
+    tool_outputs = await asyncio.gather(*(_invoke_tool(tool_call, config) for tool_call in state["messages"][-1].tool_calls))
+    return {"messages": list(tool_outputs)}
 
 # --- Conditional Router ---
 def should_continue(state: AgentState):
@@ -131,13 +159,44 @@ def should_continue(state: AgentState):
         return "continue"
     return "end"
 
+# --- Prompts ---
+# Built once and sent byte-identical on every request, so the provider's prompt-prefix cache can hit
+_SYSTEM_MSG = SystemMessage(content="""You are a helpful cybersecurity analyst.
+Your primary goal is to answer user questions about vulnerabilities and findings from a Neo4j knowledge graph.
+
+**DATABASE SCHEMA:**
+- Finding nodes have properties: id, scanner, scan_id, timestamp
+- Vulnerability nodes have properties: title, description, severity, vector, cwe_id, owasp_id
+- Asset nodes have properties: url, type, service
+- Relationships: (Finding)-[:HAS_VULNERABILITY]->(Vulnerability), (Finding)-[:AFFECTS]->(Asset)
+
+**IMPORTANT:** To get finding ID and title together, you must join Finding and Vulnerability nodes:
+MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability) RETURN f.id, v.title
+
+You have access to two tools:
+1. explain_vector(vector: str): Explains typical root causes or attack patterns for 'code', 'network', or 'config' vulnerabilities.
+2. query_neo4j(query: str): Executes a Cypher query against the Neo4j knowledge graph.
+
+Always think step-by-step and show your reasoning.
+""")
+_SYSTEM_MSG_SHORT = SystemMessage(content="You are a helpful cybersecurity analyst.")
+
 # --- Graph Definition ---
-llm = ChatOpenAI(
-    model="gpt-4o",
-    openai_api_key=os.getenv("LITELLM_API_KEY"),
-    openai_api_base=os.getenv("LITELLM_BASE_URL").rstrip("/"),
-)
-llm_with_tools = llm.bind_tools([explain_vector, query_neo4j])
+# Built on first use so importing the module never needs LiteLLM env vars; functools.cache makes it
+# one instance per model per process. All of them share async_runner.http_client(), one keep-alive pool to LiteLLM.
+# Bounded so a stalled LiteLLM upstream cannot hang a Flask worker.
+@functools.cache
+def _llm(model: str = MODEL):
+    return ChatOpenAI(
+        model=model,
+        temperature=TEMPERATURE,
+        timeout=20,
+        max_retries=3,
+        max_tokens=512,
+        openai_api_key=os.getenv("LITELLM_API_KEY"),
+        openai_api_base=(os.getenv("LITELLM_BASE_URL") or "").rstrip("/"),
+        http_async_client=async_runner.http_client(),
+    ).bind_tools(_TOOL_SCHEMAS)
 
 workflow = StateGraph(AgentState)
 workflow.add_node("agent", call_model)
@@ -153,34 +212,35 @@ chain = workflow.compile()
 
 
 def stream_agent_steps(user_msg: str, db_driver=None, external_trace_id: str = None):
+    """Sync wrapper over astream_agent_steps for Flask and the test scripts."""
+    return async_runner.iterate(astream_agent_steps(user_msg, db_driver=db_driver, external_trace_id=external_trace_id))
+
+
+async def astream_agent_steps(user_msg: str, db_driver=None, external_trace_id: str = None):
     """Streams the agent's intermediate steps, yielding a JSON object for each step with trace_id support."""
+    # Assigned before the try so the error event below can always reference it
+    current_run_id = external_trace_id or str(uuid.uuid4())
     try:
-        current_run_id = external_trace_id or str(uuid.uuid4())
-        print(f"Using run_id / trace_id: {current_run_id}")
+        log.debug("Using run_id / trace_id: %s", current_run_id)
+
+        # A near-duplicate of an already answered question skips the graph entirely
+        cached_answer, question_vector = None, None
+        if answer_cache.enabled:
+            cached_answer, question_vector = await asyncio.to_thread(answer_cache.get, user_msg)
+        if cached_answer is not None:
+            yield {
+                "step": "Final Answer",
+                "content": cached_answer,
+                "trace_id": str(current_run_id),
+                "external_trace_id": external_trace_id
+            }
+            return
 
         inputs = {
             "messages": [
-                SystemMessage(content="""You are a helpful cybersecurity analyst.
-Your primary goal is to answer user questions about vulnerabilities and findings from a Neo4j knowledge graph.
-
-**DATABASE SCHEMA:**
-- Finding nodes have properties: id, scanner, scan_id, timestamp
-- Vulnerability nodes have properties: title, description, severity, vector, cwe_id, owasp_id
-- Asset nodes have properties: url, type, service
-- Relationships: (Finding)-[:HAS_VULNERABILITY]->(Vulnerability), (Finding)-[:AFFECTS]->(Asset)
-
-**IMPORTANT:** To get finding ID and title together, you must join Finding and Vulnerability nodes:
-MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability) RETURN f.id, v.title
-
-You have access to two tools:
-1. explain_vector(vector: str): Explains typical root causes or attack patterns for 'code', 'network', or 'config' vulnerabilities.
-2. query_neo4j(query: str, db_driver: Any): Executes a Cypher query against the Neo4j knowledge graph.
-
-Always think step-by-step and show your reasoning.
-"""),
+                _SYSTEM_MSG,
                 HumanMessage(content=user_msg)
             ],
-            "db_driver": db_driver,
             "user_id": "anonymous",
             "timestamp": datetime.now().isoformat()
         }
@@ -189,47 +249,59 @@ Always think step-by-step and show your reasoning.
         config = {
             "recursion_limit": 50,
             "run_id": current_run_id,
-            "configurable": {"thread_id": current_run_id}
+            "configurable": {"thread_id": current_run_id, "db_driver": db_driver}
         }
 
-        # Stream response from the agent
-        for chunk in chain.stream(inputs, config=config, stream_mode="updates"):
-            if "agent" in chunk:
-                agent_message = chunk["agent"]["messages"][-1]
-                if agent_message.tool_calls:
-                    yield {
-                        "step": "Thought",
-                        "content": f"I should use the tool {agent_message.tool_calls[0]['name']} with the arguments {json.dumps(agent_message.tool_calls[0]['args'])}.",
-                        "trace_id": str(current_run_id),
-                        "external_trace_id": external_trace_id
-                    }
-                else:
+        final_answer = None
+        # Event stream: model tokens arrive as they are generated, tool calls as they start and finish
+        async for event in chain.astream_events(inputs, config=config, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                chunk = event["data"]["chunk"]
+                # Tool-call turns carry no text; only answer text is forwarded
+                if chunk.content and not chunk.tool_call_chunks:
                     yield {
-                        "step": "Final Answer",
-                        "content": agent_message.content,
+                        "step": "FinalAnswerDelta",
+                        "content": chunk.content,
                         "trace_id": str(current_run_id),
                         "external_trace_id": external_trace_id
                     }
 
-            elif "action" in chunk:
-                action_message = chunk["action"]["messages"][-1]
+            elif kind == "on_tool_start":
                 yield {
-                    "step": "Action",
-                    "content": f"Output of tool {action_message.name}: {action_message.content}",
+                    "step": "Thought",
+                    "content": f"I should use the tool {event['name']} with the arguments {orjson.dumps(event['data'].get('input'), default=str).decode()}.",
                     "trace_id": str(current_run_id),
                     "external_trace_id": external_trace_id
                 }
 
-            else:
+            elif kind == "on_tool_end":
+                output = event["data"].get("output")
                 yield {
-                    "step": "Unknown",
-                    "content": json.dumps(chunk),
+                    "step": "Action",
+                    "content": f"Output of tool {event['name']}: {getattr(output, 'content', output)}",
                     "trace_id": str(current_run_id),
                     "external_trace_id": external_trace_id
                 }
 
+            elif kind == "on_chain_end" and event["name"] == "agent":
+                # The complete answer is still sent once, so cached replies (no token stream) and
+                # clients that ignore deltas both get it
+                agent_message = event["data"]["output"]["messages"][-1]
+                if not agent_message.tool_calls:
+                    final_answer = agent_message.content
+                    yield {
+                        "step": "Final Answer",
+                        "content": agent_message.content,
+                        "trace_id": str(current_run_id),
+                        "external_trace_id": external_trace_id
+                    }
+
+        if final_answer and answer_cache.enabled:
+            await asyncio.to_thread(answer_cache.set, user_msg, final_answer, question_vector)
+
     except Exception as e:
-        print(f"[LangGraph STREAM ERROR] {type(e).__name__}: {e}")
+        log.error("LangGraph stream error: %s: %s", type(e).__name__, e)
         yield {
             "step": "Error",
             "content": f"An error occurred: {e}",
@@ -239,15 +311,81 @@ Always think step-by-step and show your reasoning.
 
 
 
-def ask_agent(user_msg: str, db_driver=None):
+def stream_agent_tokens(user_msg: str, db_driver=None):
+    """Sync wrapper over astream_agent_tokens."""
+    return async_runner.iterate(astream_agent_tokens(user_msg, db_driver=db_driver))
+
+
+async def astream_agent_tokens(user_msg: str, db_driver=None):
+    """Streams the final answer token by token as it is generated, yielding a JSON object per chunk."""
+    inputs = {
+        "messages": [
+            _SYSTEM_MSG_SHORT,
+            HumanMessage(content=user_msg)
+        ]
+    }
+    config = {"recursion_limit": 50, "configurable": {"db_driver": db_driver}}
+    answer = []
+    try:
+        async for message, metadata in chain.astream(inputs, config=config, stream_mode="messages"):
+            # Only the model's own text is forwarded; tool calls and tool output stay server-side
+            if metadata.get("langgraph_node") != "agent" or not message.content:
+                continue
+            answer.append(message.content)
+            # Same step name as the /chat/stream deltas, so one client handler covers both endpoints
+            yield {"step": "FinalAnswerDelta", "content": message.content}
+        yield {"step": "Final Answer", "content": "".join(answer)}
+    except Exception as e:
+        log.error("LangGraph stream error: %s: %s", type(e).__name__, e)
+        yield {"step": "Error", "content": f"An error occurred: {e}"}
+
+
+def ask_agent(user_msg: str, db_driver=None, external_trace_id: str = None):
+    """Sync wrapper over aask_agent."""
+    return async_runner.run(aask_agent(user_msg, db_driver=db_driver, external_trace_id=external_trace_id))
+
+
+async def aask_agent(user_msg: str, db_driver=None, external_trace_id: str = None):
     """Invokes the agent graph and returns the final response."""
     try:
         inputs = {"messages": [
-            SystemMessage(content="You are a helpful cybersecurity analyst."),
+            _SYSTEM_MSG_SHORT,
             HumanMessage(content=user_msg)
         ]}
-        final_state = chain.invoke(inputs, config={"db_driver": db_driver})
+        config = {"recursion_limit": 50, "configurable": {"db_driver": db_driver}}
+        if external_trace_id:
+            # Same as the streaming path: the caller's id becomes the run id, so the trace can be looked up by it
+            config["run_id"] = external_trace_id
+        final_state = await chain.ainvoke(inputs, config=config)
         return final_state["messages"][-1].content
     except Exception as e:
-        print(f"[LangGraph ERROR] {type(e).__name__}: {e}")
-        return f"An error occurred: {e}"
\ No newline at end of file
+        log.error("LangGraph error: %s: %s", type(e).__name__, e)
+        return f"An error occurred: {e}"
+
+BATCH_MAX_CONCURRENCY = 16
+
+def run_batch(user_msgs: list[str], db_driver=None) -> list[str]:
+    """Sync wrapper over arun_batch."""
+    return async_runner.run(arun_batch(user_msgs, db_driver=db_driver))
+
+
+async def arun_batch(user_msgs: list[str], db_driver=None) -> list[str]:
+    """Answers several questions in one concurrent wave, returning the final responses in input order."""
+    all_inputs = [
+        {"messages": [
+            _SYSTEM_MSG_SHORT,
+            HumanMessage(content=user_msg)
+        ]}
+        for user_msg in user_msgs
+    ]
+    config = {"recursion_limit": 50, "max_concurrency": BATCH_MAX_CONCURRENCY, "configurable": {"db_driver": db_driver}}
+    # return_exceptions keeps one failed question from discarding the rest of the batch
+    results = await chain.abatch(all_inputs, config=config, return_exceptions=True)
+    replies = []
+    for result in results:
+        if isinstance(result, Exception):
+            log.error("LangGraph batch error: %s: %s", type(result).__name__, result)
+            replies.append(f"An error occurred: {result}")
+        else:
+            replies.append(result["messages"][-1].content)
+    return replies
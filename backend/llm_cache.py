@@ -0,0 +1,109 @@
+import os
+import orjson
+import logging
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Optional persistent backend; without it entries live in a bounded in-process LRU
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+log = logging.getLogger(__name__)
+
+
+def cache_key(model: str, messages: list, temperature: float = 0, tools=None) -> str:
+    """Stable SHA-256 key for an LLM request."""
+    # Runs on every agent turn over the whole conversation, so the encode stays in C
+    raw = orjson.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "tools": tools},
+        default=str,
+        option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+    )
+    return hashlib.sha256(raw).hexdigest()
+
+
+class LLMCache:
+    """Exact-match LLM response cache keyed by cache_key().
+
+    Only identical requests share a reply; near-duplicate prompts (e.g. enrichment pairs that differ
+    in one vector) must each reach the model.
+    """
+
+    def __init__(self, path: str = "./.llm_cache", ttl: int = 86400, max_entries: int = 4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if diskcache is not None:
+            self._disk = diskcache.Cache(path, size_limit=256 * 1024 * 1024)
+            self._mem = None
+        else:
+            self._disk = None
+            self._mem = OrderedDict()
+
+    # --- Storage ---
+    def _get_exact(self, key: str):
+        if self._disk is not None:
+            return self._disk.get(key)
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._mem[key]
+                return None
+            self._mem.move_to_end(key)
+            return value
+
+    def _set_exact(self, key: str, value: str):
+        if self._disk is not None:
+            self._disk.set(key, value, expire=self.ttl)
+            return
+        with self._lock:
+            self._mem[key] = (value, time.time() + self.ttl)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    # --- Public API ---
+    def get(self, key: str):
+        value = self._get_exact(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str):
+        self._set_exact(key, value)
+
+    def clear(self):
+        """Drops every entry, e.g. once the graph the cached replies were based on has changed."""
+        if self._disk is not None:
+            self._disk.clear()
+            return
+        with self._lock:
+            self._mem.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+cache = LLMCache(
+    path=os.getenv("LLM_CACHE_DIR", "./.llm_cache"),
+    ttl=int(os.getenv("LLM_CACHE_TTL", "86400")),
+)
+
+# Agent turns depend on what the graph held when their tool calls ran, so they get their own short-lived
+# store that enrichment can clear without throwing away the enrichment verdicts above
+agent_cache = LLMCache(
+    path=os.path.join(os.getenv("LLM_CACHE_DIR", "./.llm_cache"), "agent"),
+    ttl=int(os.getenv("AGENT_CACHE_TTL", "300")),
+)
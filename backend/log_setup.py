@@ -0,0 +1,43 @@
+# Queue-based logging for app.py: request threads only enqueue records, a listener thread writes them.
+# Kept out of app.py so the formatting can be exercised without importing Flask or the agents.
+import copy
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+_LOG_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any `extra=` fields, for structured log pipelines."""
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+        entry.update((k, v) for k, v in vars(record).items() if k not in _LOG_RECORD_FIELDS)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class _LogQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The stock prepare() formats the record here and drops exc_info, so the listener's formatter
+        # would format it a second time and never see the traceback. Only the message is resolved
+        # (args may be mutated after the call returns); the queue is in-process, so exc_info can travel.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def queue_logging(fmt: str = "text", stream=None):
+    """Returns the QueueHandler to install and the started listener that writes its records to stream."""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt.lower() == "json" else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return _LogQueueHandler(log_queue), listener
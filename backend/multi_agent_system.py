@@ -1,164 +1,204 @@
 import os
-from typing import TypedDict, Annotated, Any
+import asyncio
+import functools
+from typing import TypedDict, Annotated
 from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage, AIMessage
-from langgraph.graph import StateGraph, END
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import StreamWriter
+from langgraph.config import get_config
 from langchain_core.tools import tool
 from langchain_openai import ChatOpenAI
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from dotenv import load_dotenv
-import json
-from neo4j import GraphDatabase
+import logging
 import time
 import uuid
-from datetime import datetime, date
+from datetime import datetime
+import async_runner
 
 load_dotenv()
 
-# --- Neo4j Driver Initialization ---
-driver = None 
-try:
-    NEO4J_URI = os.getenv("NEO4J_URI")
-    NEO4J_USER = os.getenv("NEO4J_USER")
-    NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+log = logging.getLogger(__name__)
 
-    if not all([NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD]):
-        print("WARNING: Neo4j environment variables (NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD) not fully set. Database connection will likely fail.")
-    else:
-        driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-        driver.verify_connectivity()
-        print("Neo4j driver initialized and connected successfully in multi-agent system!")
-except Exception as e:
-    print(f"CRITICAL ERROR: Failed to initialize Neo4j driver in multi-agent system: {e}")
-    driver = None
+# --- Neo4j Driver ---
+# The async twin of the process-wide driver in common, so tool queries never block the agents' event loop
+from common import get_async_driver
+from query_cache import cache as query_cache, cacheable
+from cypher_guard import check_cypher
+from neo4j_query import (
+    READ_SESSION, NO_RESULTS, TIMEOUT_MESSAGE, query_ids, abounded_records, encode_records, is_timeout,
+)
+
+def _debug() -> bool:
+    # Per-query trace records are DEBUG-only; checking first skips building their extra= dicts
+    return log.isEnabledFor(logging.DEBUG)
 
 # --- Shared Tools ---
-@tool   
-def query_neo4j(query: str, db_driver: Any = None) -> str:
-    """Executes a Cypher query against the Neo4j database and returns the results."""
-    query_id = str(uuid.uuid4())[:8]
+def _run_queries():
+    """The current run's {query key: task} map, or None outside a multi-agent run."""
+    try:
+        return get_config().get("configurable", {}).get("query_results")
+    except RuntimeError:
+        return None
+
+async def _run_query(query: str, params: dict = None) -> str:
+    # The four agents often look up the same finding or CWE at the same moment; within one run,
+    # identical queries share a single round-trip, even while the first is still in flight
+    run_queries = _run_queries()
+    if run_queries is None:
+        return await _fetch_query(query, params)
+    key = (query, repr(sorted(params.items())) if params else "")
+    task = run_queries.get(key)
+    if task is None:
+        task = run_queries[key] = asyncio.ensure_future(_fetch_query(query, params))
+    # Shielded so one agent being cancelled does not cancel the lookup the others are waiting on
+    return await asyncio.shield(task)
+
+async def _fetch_query(query: str, params: dict = None) -> str:
+    query_id = f"{next(query_ids):08x}"
     start_time = time.time()
     
-    def serialize_value(value):
-        # Handle Neo4j DateTime objects
-        if hasattr(value, 'iso_format'):
-            return value.iso_format()
-        if hasattr(value, 'isoformat'):
-            return value.isoformat()
-        if isinstance(value, (datetime, date)):
-            return value.isoformat()
-        if isinstance(value, dict):
-            return {k: serialize_value(v) for k, v in value.items()}
-        if isinstance(value, list):
-            return [serialize_value(v) for v in value]
-        return value
-    
-    print(f"---CALLING TOOL: query_neo4j with query: {query}---")
+    log.debug("Calling tool query_neo4j with query: %s", query)
     
-    # Use the passed db_driver or fall back to the global driver
-    db_driver_to_use = db_driver if db_driver is not None else driver
-    
-    if db_driver_to_use is None:
+    async_driver = get_async_driver()
+    if async_driver is None:
         return "Error: Neo4j database driver not available."
 
+    use_cache = cacheable(query)
+    if use_cache:
+        cached = query_cache.get(query, params)
+        if cached is not None:
+            if _debug():
+                log.debug("query_cache_hit", extra={"query_id": query_id})
+            return cached
+
     try:
-        with db_driver_to_use.session() as session:
-            result = session.run(query)
-            records = [serialize_value(record.data()) for record in result]
-        if records:
-            duration = time.time() - start_time
-            print(f"[QUERY-{query_id}] Completed in {duration:.3f}s")
-            return json.dumps(records, indent=2)
+        async with async_driver.session(**READ_SESSION) as session:
+            records, truncated = await session.execute_read(abounded_records, query, params)
+        # A truncated result always goes back with its note, never as "no results"
+        if records or truncated:
+            if _debug():
+                duration = time.time() - start_time
+                log.debug("query_complete", extra={"query_id": query_id, "duration_ms": int(duration * 1000), "rows": len(records)})
+            payload = encode_records(records, truncated)
+            if use_cache:
+                query_cache.set(query, payload, params)
+            return payload
         else:
-            duration = time.time() - start_time
-            print(f"[QUERY-{query_id}] No results in {duration:.3f}s")
-            return "No results found for the query."
+            if _debug():
+                duration = time.time() - start_time
+                log.debug("query_empty", extra={"query_id": query_id, "duration_ms": int(duration * 1000)})
+            return NO_RESULTS
     except Exception as e:
         duration = time.time() - start_time
-        print(f"[QUERY-{query_id}] Error in {duration:.3f}s: {e}")
+        if is_timeout(e):
+            log.warning("query_timeout", extra={"query_id": query_id, "duration_ms": int(duration * 1000)})
+            return TIMEOUT_MESSAGE
+        log.warning("query_error %s", e, extra={"query_id": query_id, "duration_ms": int(duration * 1000)})
         return f"Error executing Neo4j query: {e}"
 
-# --- Analysis Agent Tools ---
 @tool
-def analyze_vulnerability_severity(finding_id: str, db_driver: Any = None) -> str:
-    """Analyzes the severity and impact of a specific vulnerability finding."""
-    query = f"""
-    MATCH (f:Finding {{id: '{finding_id}'}})-[:HAS_VULNERABILITY]->(v:Vulnerability)
+async def query_neo4j(query: str) -> str:
+    """Executes a Cypher query against the Neo4j database and returns the results."""
+    # Only model-written Cypher is checked; the purpose-built tools below use fixed templates
+    rejected = check_cypher(query)
+    if rejected:
+        return rejected
+    return await _run_query(query)
+
+# --- Analysis Agent Tools ---
+# Tool queries are fixed strings with $parameters, so Neo4j plans each one once and reuses the
+# cached plan, and model-supplied ids are bound as values instead of spliced into the Cypher
+
+# Severity -> score tables live here once and are bound as $weights, so the scoring queries share
+# one lookup expression instead of each spelling out its own CASE
+RISK_WEIGHTS = {"CRITICAL": 10, "HIGH": 7, "MEDIUM": 4, "LOW": 1}
+PRIORITY_WEIGHTS = {"CRITICAL": 4, "HIGH": 3, "MEDIUM": 2, "LOW": 1}
+_SEVERITY_SCORE = "coalesce($weights[v.severity], 0)"
+
+# The severity and risk tools keep separate projections: each agent gets its own evidence, under the
+# field names the prompts and the synthesizer's sections were written against
+SEVERITY_QUERY = """
+    MATCH (f:Finding {id: $finding_id})-[:HAS_VULNERABILITY]->(v:Vulnerability)
     OPTIONAL MATCH (f)-[:AFFECTS]->(a:Asset)
-    RETURN f.id as finding_id, v.title as vulnerability, v.severity as severity, 
-           v.description as description, v.vector as vector, 
+    RETURN f.id as finding_id, v.title as vulnerability, v.severity as severity,
+           v.description as description, v.vector as vector, v.cwe_id as cwe_id,
            COALESCE(a.url, a.path, a.image, 'Unknown') as asset_url
+    LIMIT 100
     """
-    return query_neo4j(query, db_driver)
 
 @tool
-def find_similar_vulnerabilities(cwe_id: str, db_driver: Any = None) -> str:
-    """Finds vulnerabilities with the same CWE ID to identify patterns."""
-    query = f"""
-    MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability {{cwe_id: '{cwe_id}'}})
+async def analyze_vulnerability_severity(finding_id: str) -> str:
+    """Analyzes the severity and impact of a specific vulnerability finding."""
+    return await _run_query(SEVERITY_QUERY, {"finding_id": finding_id})
+
+# Ranked by severity weight, not the severity string (which sorts MEDIUM above CRITICAL),
+# so the LIMIT drops the least severe findings first
+SIMILAR_QUERY = f"""
+    MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability {{cwe_id: $cwe_id}})
     RETURN f.id as finding_id, v.title as vulnerability, v.severity as severity
-    ORDER BY v.severity DESC
+    ORDER BY {_SEVERITY_SCORE} DESC, finding_id
+    LIMIT 100
     """
-    return query_neo4j(query, db_driver)
 
-# --- Correlation Agent Tools ---
 @tool
-def find_attack_chains(finding_id: str, db_driver: Any = None) -> str:
-    """Identifies potential attack chains starting from a specific finding."""
-    query = f"""
-    MATCH (f:Finding {{id: '{finding_id}'}})-[:HAS_VULNERABILITY]->(v:Vulnerability)
+async def find_similar_vulnerabilities(cwe_id: str) -> str:
+    """Finds vulnerabilities with the same CWE ID to identify patterns."""
+    return await _run_query(SIMILAR_QUERY, {"cwe_id": cwe_id, "weights": PRIORITY_WEIGHTS})
+
+# --- Correlation Agent Tools ---
+ATTACK_CHAINS_QUERY = """
+    MATCH (f:Finding {id: $finding_id})-[:HAS_VULNERABILITY]->(v:Vulnerability)
     MATCH (f)-[:AFFECTS]->(a:Asset)
     OPTIONAL MATCH (a)<-[:AFFECTS]-(f2:Finding)-[:HAS_VULNERABILITY]->(v2:Vulnerability)
     WHERE f2.id <> f.id
     RETURN f.id as source_finding, v.title as source_vuln, a.url as target_asset,
            f2.id as related_finding, v2.title as related_vuln
+    LIMIT 100
     """
-    return query_neo4j(query, db_driver)
 
 @tool
-def analyze_temporal_patterns(db_driver: Any = None) -> str:
-    """Analyzes temporal patterns in vulnerability discoveries."""
-    query = """
+async def find_attack_chains(finding_id: str) -> str:
+    """Identifies potential attack chains starting from a specific finding."""
+    return await _run_query(ATTACK_CHAINS_QUERY, {"finding_id": finding_id})
+
+# The IS NOT NULL predicate lets the planner answer from the finding_ts index (values included)
+# rather than a label scan plus a property read per node
+TEMPORAL_QUERY = """
     MATCH (f:Finding)
+    WHERE f.timestamp IS NOT NULL
     WITH f.timestamp as scan_time, count(f) as finding_count
     ORDER BY scan_time
     RETURN scan_time, finding_count
     LIMIT 10
     """
-    return query_neo4j(query, db_driver)
 
-# --- Risk Assessment Agent Tools ---
 @tool
-def calculate_risk_score(finding_id: str, db_driver: Any = None) -> str:
-    """Calculates a risk score for a specific finding based on multiple factors."""
-    query = f"""
-    MATCH (f:Finding {{id: '{finding_id}'}})-[:HAS_VULNERABILITY]->(v:Vulnerability)
+async def analyze_temporal_patterns() -> str:
+    """Analyzes temporal patterns in vulnerability discoveries."""
+    return await _run_query(TEMPORAL_QUERY)
+
+# --- Risk Assessment Agent Tools ---
+RISK_SCORE_QUERY = f"""
+    MATCH (f:Finding {{id: $finding_id}})-[:HAS_VULNERABILITY]->(v:Vulnerability)
     OPTIONAL MATCH (f)-[:AFFECTS]->(a:Asset)
-    WITH f, v, a,
-         CASE v.severity 
-           WHEN 'CRITICAL' THEN 10 
-           WHEN 'HIGH' THEN 7 
-           WHEN 'MEDIUM' THEN 4 
-           WHEN 'LOW' THEN 1 
-           ELSE 0 
-         END as severity_score
     RETURN f.id as finding_id, v.title as vulnerability, v.severity as severity,
-           severity_score as risk_score, 
+           {_SEVERITY_SCORE} as risk_score,
            COALESCE(a.url, a.path, a.image, 'Unknown') as affected_asset
+    LIMIT 100
     """
-    return query_neo4j(query, db_driver)
 
 @tool
-def assess_asset_criticality(asset_url: str, db_driver: Any = None) -> str:
-    """Assesses the criticality of an asset based on vulnerability exposure."""
-    query = f"""
+async def calculate_risk_score(finding_id: str) -> str:
+    """Calculates a risk score for a specific finding based on multiple factors."""
+    return await _run_query(RISK_SCORE_QUERY, {"finding_id": finding_id, "weights": RISK_WEIGHTS})
+
+ASSET_CRITICALITY_QUERY = """
     MATCH (f:Finding)-[:AFFECTS]->(a:Asset)
-    WHERE a.url = '{asset_url}' OR a.path = '{asset_url}' OR a.image = '{asset_url}'
+    WHERE a.url = $asset_url OR a.path = $asset_url OR a.image = $asset_url
     MATCH (f)-[:HAS_VULNERABILITY]->(v:Vulnerability)
     WITH a, count(f) as vulnerability_count,
-         sum(CASE v.severity 
-               WHEN 'CRITICAL' THEN 1 
-               WHEN 'HIGH' THEN 1 
-               ELSE 0 
-             END) as high_critical_count
+         sum(CASE WHEN v.severity IN ['CRITICAL', 'HIGH'] THEN 1 ELSE 0 END) as high_critical_count
     RETURN COALESCE(a.url, a.path, a.image, 'Unknown') as asset, 
            vulnerability_count, high_critical_count,
            CASE 
@@ -168,82 +208,106 @@ def assess_asset_criticality(asset_url: str, db_driver: Any = None) -> str:
              ELSE 'LOW'
            END as asset_criticality
     """
-    return query_neo4j(query, db_driver)
 
-# --- Recommendation Agent Tools ---
 @tool
-def generate_mitigation_strategy(cwe_id: str, db_driver: Any = None) -> str:
-    """Generates mitigation strategies for vulnerabilities with specific CWE IDs."""
-    query = f"""
-    MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability {{cwe_id: '{cwe_id}'}})
+async def assess_asset_criticality(asset_url: str) -> str:
+    """Assesses the criticality of an asset based on vulnerability exposure."""
+    return await _run_query(ASSET_CRITICALITY_QUERY, {"asset_url": asset_url})
+
+# --- Recommendation Agent Tools ---
+MITIGATION_QUERY = """
+    MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability {cwe_id: $cwe_id})
     RETURN DISTINCT v.cwe_id as cwe_id, v.title as vulnerability_title,
            v.description as description, v.vector as attack_vector
     LIMIT 1
     """
-    return query_neo4j(query, db_driver)
 
 @tool
-def find_priority_remediation_order(db_driver: Any = None) -> str:
-    """Finds the optimal order for remediating vulnerabilities based on risk and impact."""
-    query = """
+async def generate_mitigation_strategy(cwe_id: str) -> str:
+    """Generates mitigation strategies for vulnerabilities with specific CWE IDs."""
+    return await _run_query(MITIGATION_QUERY, {"cwe_id": cwe_id})
+
+REMEDIATION_ORDER_QUERY = f"""
     MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability)
     OPTIONAL MATCH (f)-[:AFFECTS]->(a:Asset)
-    WITH f, v, a,
-         CASE v.severity 
-           WHEN 'CRITICAL' THEN 4 
-           WHEN 'HIGH' THEN 3 
-           WHEN 'MEDIUM' THEN 2 
-           WHEN 'LOW' THEN 1 
-           ELSE 0 
-         END as priority_score
+    WITH f, v, a, {_SEVERITY_SCORE} as priority_score
     RETURN f.id as finding_id, v.title as vulnerability, v.severity as severity,
            priority_score, COALESCE(a.url, a.path, a.image, 'Unknown') as affected_asset
     ORDER BY priority_score DESC, f.id
     LIMIT 10
     """
-    return query_neo4j(query, db_driver)
+
+@tool
+async def find_priority_remediation_order() -> str:
+    """Finds the optimal order for remediating vulnerabilities based on risk and impact."""
+    return await _run_query(REMEDIATION_ORDER_QUERY, {"weights": PRIORITY_WEIGHTS})
 
 # --- Agent State ---
 class MultiAgentState(TypedDict):
     messages: Annotated[list[AnyMessage], lambda x, y: x + y]
-    db_driver: Any
     trace_id: str
     user_id: str
     timestamp: str
-    current_agent: str
     analysis_results: dict
     correlation_results: dict
     risk_results: dict
     recommendation_results: dict
 
 # --- Agent Definitions ---
-llm = ChatOpenAI(
-    model="gpt-4o",
-    openai_api_key=os.getenv("LITELLM_API_KEY"),
-    openai_api_base=os.getenv("LITELLM_BASE_URL").rstrip("/"),
-)
-
 # Analysis Agent
 analysis_tools = [analyze_vulnerability_severity, find_similar_vulnerabilities, query_neo4j]
-analysis_llm = llm.bind_tools(analysis_tools)
 
 # Correlation Agent  
 correlation_tools = [find_attack_chains, analyze_temporal_patterns, query_neo4j]
-correlation_llm = llm.bind_tools(correlation_tools)
 
 # Risk Assessment Agent
 risk_tools = [calculate_risk_score, assess_asset_criticality, query_neo4j]
-risk_llm = llm.bind_tools(risk_tools)
 
 # Recommendation Agent
 recommendation_tools = [generate_mitigation_strategy, find_priority_remediation_order, query_neo4j]
-recommendation_llm = llm.bind_tools(recommendation_tools)
 
-# --- Agent Functions ---
-def analysis_agent(state: MultiAgentState):
-    """Analysis Agent: Analyzes vulnerability details and patterns."""
-    print("---ANALYSIS AGENT WORKING---")
-    system_prompt = """You are a Vulnerability Analysis Agent. Your role is to:
+AGENT_TOOLS = {
+    "analysis": analysis_tools,
+    "correlation": correlation_tools,
+    "risk": risk_tools,
+    "recommendation": recommendation_tools,
+}
+
+# Every tool by the name the model calls it
+TOOL_REGISTRY = {t.name: t for tools in AGENT_TOOLS.values() for t in tools}
+
+# Each tool is converted to its OpenAI schema once at import (query_neo4j is shared by all four agents)
+_TOOL_SCHEMAS = {name: convert_to_openai_tool(t) for name, t in TOOL_REGISTRY.items()}
+
+# Built on first use so importing the module never needs LiteLLM env vars; one client per process.
+# Bounded so a stalled LiteLLM upstream cannot hang a Flask worker; the
+# recommendation step writes longer answers, hence the larger token cap
+@functools.cache
+def _llm():
+    return ChatOpenAI(
+        model="gpt-4o",
+        timeout=20,
+        max_retries=3,
+        max_tokens=1024,
+        openai_api_key=os.getenv("LITELLM_API_KEY"),
+        openai_api_base=(os.getenv("LITELLM_BASE_URL") or "").rstrip("/"),
+        http_async_client=async_runner.http_client(),
+    )
+
+@functools.cache
+def _agent_llm(agent: str):
+    # All four agents share the one underlying client and its connection pool
+    return _llm().bind_tools([_TOOL_SCHEMAS[t.name] for t in AGENT_TOOLS[agent]])
+
+@functools.cache
+def _final_llm(agent: str):
+    # Same tools as _agent_llm, so the tool_calls already in the history stay valid for the provider,
+    # but no new call can be made
+    return _llm().bind_tools([_TOOL_SCHEMAS[t.name] for t in AGENT_TOOLS[agent]], tool_choice="none")
+
+# --- Agent Prompts ---
+# Built once and sent byte-identical on every request, so the provider's prompt-prefix cache can hit
+ANALYSIS_SYSTEM_MSG = SystemMessage(content="""You are a Vulnerability Analysis Agent. Your role is to:
 1. Analyze vulnerability severity and impact
 2. Identify patterns in similar vulnerabilities
 3. Provide detailed technical analysis
@@ -263,16 +327,9 @@ You have access to these tools:
 2. find_similar_vulnerabilities(cwe_id: str): Finds vulnerabilities with the same CWE ID to identify patterns
 3. query_neo4j(query: str): Executes a Cypher query against the Neo4j knowledge graph
 
-For general database queries, always use query_neo4j first to gather information."""
-    
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
-    response = analysis_llm.invoke(messages)
-    return {"messages": [response], "current_agent": "analysis"}
+For general database queries, always use query_neo4j first to gather information.""")
 
-def correlation_agent(state: MultiAgentState):
-    """Correlation Agent: Identifies relationships and attack chains."""
-    print("---CORRELATION AGENT WORKING---")
-    system_prompt = """You are a Vulnerability Correlation Agent. Your role is to:
+CORRELATION_SYSTEM_MSG = SystemMessage(content="""You are a Vulnerability Correlation Agent. Your role is to:
 1. Identify attack chains and relationships between findings
 2. Analyze temporal patterns in vulnerability discovery
 3. Connect related vulnerabilities across different assets
@@ -289,16 +346,9 @@ You have access to these tools:
 2. analyze_temporal_patterns(): Analyzes temporal patterns in vulnerability discoveries
 3. query_neo4j(query: str): Executes a Cypher query against the Neo4j knowledge graph
 
-For general database queries, always use query_neo4j first to gather information."""
-    
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
-    response = correlation_llm.invoke(messages)
-    return {"messages": [response], "current_agent": "correlation"}
+For general database queries, always use query_neo4j first to gather information.""")
 
-def risk_assessment_agent(state: MultiAgentState):
-    """Risk Assessment Agent: Evaluates risk levels and asset criticality."""
-    print("---RISK ASSESSMENT AGENT WORKING---")
-    system_prompt = """You are a Risk Assessment Agent. Your role is to:
+RISK_SYSTEM_MSG = SystemMessage(content="""You are a Risk Assessment Agent. Your role is to:
 1. Calculate risk scores for vulnerabilities
 2. Assess asset criticality and exposure
 3. Evaluate business impact
@@ -315,16 +365,9 @@ You have access to these tools:
 2. assess_asset_criticality(asset_url: str): Assesses the criticality of an asset based on vulnerability exposure
 3. query_neo4j(query: str): Executes a Cypher query against the Neo4j knowledge graph
 
-For general database queries, always use query_neo4j first to gather information."""
-    
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
-    response = risk_llm.invoke(messages)
-    return {"messages": [response], "current_agent": "risk"}
+For general database queries, always use query_neo4j first to gather information.""")
 
-def recommendation_agent(state: MultiAgentState):
-    """Recommendation Agent: Provides mitigation strategies and remediation plans."""
-    print("---RECOMMENDATION AGENT WORKING---")
-    system_prompt = """You are a Recommendation Agent. Your role is to:
+RECOMMENDATION_SYSTEM_MSG = SystemMessage(content="""You are a Recommendation Agent. Your role is to:
 1. Generate specific mitigation strategies
 2. Create prioritized remediation plans
 3. Provide actionable security recommendations
@@ -341,180 +384,135 @@ You have access to these tools:
 2. find_priority_remediation_order(): Finds the optimal order for remediating vulnerabilities based on risk and impact
 3. query_neo4j(query: str): Executes a Cypher query against the Neo4j knowledge graph
 
-For general database queries, always use query_neo4j first to gather information."""
-    
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
-    response = recommendation_llm.invoke(messages)
-    return {"messages": [response], "current_agent": "recommendation"}
-
-def execute_tools(state: MultiAgentState):
-    """Executes tools based on the current agent's response."""
-    last_message = state["messages"][-1]
-    tool_outputs = []
-    db_driver = state.get("db_driver")
-    current_agent = state.get("current_agent", "unknown")
-
-    print(f"---DEBUG: db_driver in execute_tools: {db_driver is not None}---")
-
-    for tool_call in last_message.tool_calls:
-        tool_name = tool_call["name"]
-        print(f"---{current_agent.upper()} AGENT EXECUTING TOOL: {tool_name}---")
-        try:
-            # Get the appropriate tool function
-            tool_func = None
-            if tool_name == "analyze_vulnerability_severity":
-                tool_func = analyze_vulnerability_severity
-            elif tool_name == "find_similar_vulnerabilities":
-                tool_func = find_similar_vulnerabilities
-            elif tool_name == "find_attack_chains":
-                tool_func = find_attack_chains
-            elif tool_name == "analyze_temporal_patterns":
-                tool_func = analyze_temporal_patterns
-            elif tool_name == "calculate_risk_score":
-                tool_func = calculate_risk_score
-            elif tool_name == "assess_asset_criticality":
-                tool_func = assess_asset_criticality
-            elif tool_name == "generate_mitigation_strategy":
-                tool_func = generate_mitigation_strategy
-            elif tool_name == "find_priority_remediation_order":
-                tool_func = find_priority_remediation_order
-            elif tool_name == "query_neo4j":
-                tool_func = query_neo4j
-            
-            if tool_func:
-                tool_args = tool_call["args"].copy()
-                # Always add db_driver to tool_args if the tool accepts it
-                if hasattr(tool_func, '__annotations__') and 'db_driver' in tool_func.__annotations__:
-                    tool_args["db_driver"] = db_driver
-                tool_output = tool_func.invoke(tool_args)
-                tool_outputs.append(
-                    ToolMessage(content=str(tool_output), tool_call_id=tool_call["id"])
-                )
-            else:
-                tool_outputs.append(
-                    ToolMessage(content=f"Unknown tool: {tool_name}", tool_call_id=tool_call["id"])
-                )
-        except Exception as e:
-            tool_outputs.append(
-                ToolMessage(content=f"Error executing tool {tool_name}: {e}", tool_call_id=tool_call["id"])
-            )
-    return {"messages": tool_outputs}
-
-# --- Multi-Agent Orchestrator ---
-def orchestrator(state: MultiAgentState):
-    """Orchestrates the flow between different agents."""
-    user_message = state["messages"][-1].content if state["messages"] else ""
-    current_agent = state.get("current_agent", "")
-    
-    # Simple routing logic - can be made more sophisticated
-    if not current_agent:
-        # First time - start with analysis
-        return {"current_agent": "analysis"}
-    elif current_agent == "analysis":
-        return {"current_agent": "correlation"}
-    elif current_agent == "correlation":
-        return {"current_agent": "risk"}
-    elif current_agent == "risk":
-        return {"current_agent": "recommendation"}
-    else:
-        # After recommendation, end
-        return {"current_agent": "end"}
-
-def should_continue(state: MultiAgentState):
-    """Determines if the agent should continue or end."""
-    last_message = state["messages"][-1]
-    if isinstance(last_message, AIMessage) and last_message.tool_calls:
-        return "tools"
-    return "orchestrator"
-
-def route_to_agent(state: MultiAgentState):
-    """Routes to the appropriate agent based on current_agent state."""
-    current_agent = state.get("current_agent", "")
-    if current_agent == "analysis":
-        return "analysis"
-    elif current_agent == "correlation":
-        return "correlation"
-    elif current_agent == "risk":
-        return "risk"
-    elif current_agent == "recommendation":
-        return "recommendation"
-    else:
-        return END
+For general database queries, always use query_neo4j first to gather information.""")
 
-# --- Multi-Agent Graph ---
-workflow = StateGraph(MultiAgentState)
+# --- Agent Functions ---
+# Each agent gets a few LLM turns so it can read its own tool results and write up its findings
+AGENT_MAX_TURNS = 3
+
+# Per-agent display strings for the progress stream
+AGENT_STEPS = {
+    "analysis": ("Analysis Agent", "🔍 Analyzing vulnerability patterns and details...", "Analysis Complete"),
+    "correlation": ("Correlation Agent", "🔗 Identifying relationships and attack chains...", "Correlation Complete"),
+    "risk": ("Risk Assessment Agent", "⚠️ Calculating risk scores and assessing criticality...", "Risk Assessment Complete"),
+    "recommendation": ("Recommendation Agent", "💡 Generating mitigation strategies and remediation plans...", "Recommendation Complete"),
+}
+# The "working" events never change, so each is built once; the stream copies them when adding trace ids
+_WORKING_EVENTS = {agent: {"step": step, "content": working, "agent": agent}
+                   for agent, (step, working, _) in AGENT_STEPS.items()}
+
+async def _invoke_tool(agent: str, tool_call, writer: StreamWriter):
+    tool_name = tool_call["name"]
+    log.debug("%s agent executing tool %s", agent, tool_name)
+    tool_func = TOOL_REGISTRY.get(tool_name)
+    try:
+        if tool_func:
+            tool_output = await tool_func.ainvoke(tool_call["args"])
+            message = ToolMessage(content=str(tool_output), tool_call_id=tool_call["id"])
+        else:
+            message = ToolMessage(content=f"Unknown tool: {tool_name}", tool_call_id=tool_call["id"])
+    except Exception as e:
+        message = ToolMessage(content=f"Error executing tool {tool_name}: {e}", tool_call_id=tool_call["id"])
+    writer({"step": "Tool Execution", "content": f"🛠️ {message.content}", "agent": "tools"})
+    return message
+
+async def execute_tools(agent: str, tool_calls: list, writer: StreamWriter):
+    """Executes one agent turn's tool calls concurrently, reporting each result on the custom stream as it lands."""
+    # gather keeps the ToolMessages in tool_call order
+    return list(await asyncio.gather(*(_invoke_tool(agent, tool_call, writer) for tool_call in tool_calls)))
+
+_OUT_OF_TURNS_MSG = HumanMessage(content=(
+    f"You have used all {AGENT_MAX_TURNS} tool turns. Do not call any more tools; "
+    "answer now using only the tool results above, and say what you could not check."
+))
+
+async def _run_agent(agent: str, system_msg: SystemMessage, state: MultiAgentState, writer: StreamWriter):
+    """Runs one agent's tool loop on its own copy of the conversation and returns its final message."""
+    llm = _agent_llm(agent)
+    messages = [system_msg] + state["messages"]
+    for _ in range(AGENT_MAX_TURNS):
+        response = await llm.ainvoke(messages)
+        if not response.tool_calls:
+            break
+        writer(_WORKING_EVENTS[agent])
+        messages = messages + [response] + await execute_tools(agent, response.tool_calls, writer)
+    else:
+        # Out of turns while still calling tools: say so, and ask for a write-up of what it has
+        response = await _final_llm(agent).ainvoke(messages + [_OUT_OF_TURNS_MSG])
+    return {"messages": [response], f"{agent}_results": {"content": response.content}}
 
-# Add agent nodes
-workflow.add_node("analysis", analysis_agent)
-workflow.add_node("correlation", correlation_agent)
-workflow.add_node("risk", risk_assessment_agent)
-workflow.add_node("recommendation", recommendation_agent)
-workflow.add_node("tools", execute_tools)
-workflow.add_node("orchestrator", orchestrator)
-
-# Set entry point
-workflow.set_entry_point("orchestrator")
-
-# Add conditional edges
-workflow.add_conditional_edges(
-    "orchestrator",
-    route_to_agent,
-    {
-        "analysis": "analysis",
-        "correlation": "correlation", 
-        "risk": "risk",
-        "recommendation": "recommendation",
-        END: END
-    }
-)
+async def analysis_agent(state: MultiAgentState, writer: StreamWriter):
+    """Analysis Agent: Analyzes vulnerability details and patterns."""
+    log.debug("Analysis agent working")
+    return await _run_agent("analysis", ANALYSIS_SYSTEM_MSG, state, writer)
 
-workflow.add_conditional_edges(
-    "analysis",
-    should_continue,
-    {"tools": "tools", "orchestrator": "orchestrator"}
-)
+async def correlation_agent(state: MultiAgentState, writer: StreamWriter):
+    """Correlation Agent: Identifies relationships and attack chains."""
+    log.debug("Correlation agent working")
+    return await _run_agent("correlation", CORRELATION_SYSTEM_MSG, state, writer)
 
-workflow.add_conditional_edges(
-    "correlation", 
-    should_continue,
-    {"tools": "tools", "orchestrator": "orchestrator"}
-)
+async def risk_assessment_agent(state: MultiAgentState, writer: StreamWriter):
+    """Risk Assessment Agent: Evaluates risk levels and asset criticality."""
+    log.debug("Risk assessment agent working")
+    return await _run_agent("risk", RISK_SYSTEM_MSG, state, writer)
 
-workflow.add_conditional_edges(
-    "risk",
-    should_continue,
-    {"tools": "tools", "orchestrator": "orchestrator"}
-)
+async def recommendation_agent(state: MultiAgentState, writer: StreamWriter):
+    """Recommendation Agent: Provides mitigation strategies and remediation plans."""
+    log.debug("Recommendation agent working")
+    return await _run_agent("recommendation", RECOMMENDATION_SYSTEM_MSG, state, writer)
+
+# --- Synthesizer ---
+def synthesizer(state: MultiAgentState):
+    """Joins the four agents' write-ups into one report, in a fixed order regardless of which finished first."""
+    sections = []
+    for agent, (step, _, _) in AGENT_STEPS.items():
+        content = state.get(f"{agent}_results", {}).get("content")
+        if content:
+            sections.append(f"## {step}\n{content}")
+    return {"messages": [AIMessage(content="\n\n".join(sections))]}
 
-workflow.add_conditional_edges(
-    "recommendation",
-    should_continue,
-    {"tools": "tools", "orchestrator": "orchestrator"}
-)
+# --- Multi-Agent Graph ---
+# The agents only depend on the user's question, so all four start together and the
+# synthesizer runs once every branch has finished: latency is the slowest agent, not the sum.
+workflow = StateGraph(MultiAgentState)
 
-workflow.add_edge("tools", "orchestrator")
+AGENT_NODES = {
+    "analysis": analysis_agent,
+    "correlation": correlation_agent,
+    "risk": risk_assessment_agent,
+    "recommendation": recommendation_agent,
+}
+for name, node in AGENT_NODES.items():
+    workflow.add_node(name, node)
+    workflow.add_edge(START, name)
+workflow.add_node("synthesizer", synthesizer)
+workflow.add_edge(list(AGENT_NODES), "synthesizer")
+workflow.add_edge("synthesizer", END)
 
 # Compile the multi-agent system
 multi_agent_chain = workflow.compile()
 
 # --- Streaming Function ---
 def stream_multi_agent_steps(user_msg: str, db_driver=None, external_trace_id: str = None):
-    """Streams the multi-agent system's steps."""
-    try:
-        current_run_id = external_trace_id or str(uuid.uuid4())
-        print(f"Multi-Agent System using run_id: {current_run_id}")
-        print(f"---DEBUG: db_driver in stream_multi_agent_steps: {db_driver is not None}---")
+    """Sync wrapper over astream_multi_agent_steps for Flask.
+
+    db_driver is accepted for API compatibility; the tools always use the shared async driver from common.
+    """
+    return async_runner.iterate(astream_multi_agent_steps(user_msg, external_trace_id=external_trace_id))
 
-        # Use the passed db_driver or fall back to the global driver
-        db_driver_to_use = db_driver if db_driver is not None else driver
+
+async def astream_multi_agent_steps(user_msg: str, external_trace_id: str = None):
+    """Streams the multi-agent system's steps as the parallel agents make progress."""
+    # Assigned before the try so the error event below can always reference it
+    current_run_id = external_trace_id or str(uuid.uuid4())
+    try:
+        log.debug("Multi-agent system using run_id: %s", current_run_id)
 
         inputs = {
             "messages": [HumanMessage(content=user_msg)],
-            "db_driver": db_driver_to_use,  # Use the available driver
-            "trace_id": str(current_run_id),  # Add the missing trace_id
+            "trace_id": str(current_run_id),
             "user_id": "anonymous",
             "timestamp": datetime.now().isoformat(),
-            "current_agent": "",
             "analysis_results": {},
             "correlation_results": {},
             "risk_results": {},
@@ -524,102 +522,36 @@ def stream_multi_agent_steps(user_msg: str, db_driver=None, external_trace_id: s
         config = {
             "recursion_limit": 100,
             "run_id": current_run_id,
-            "configurable": {"thread_id": current_run_id}
+            # Fresh per run, so shared query results never outlive the question that produced them
+            "configurable": {"thread_id": current_run_id, "query_results": {}}
         }
 
-        for chunk in multi_agent_chain.stream(inputs, config=config, stream_mode="updates"):
-            if "analysis" in chunk:
-                agent_message = chunk["analysis"]["messages"][-1]
-                if agent_message.tool_calls:
-                    yield {
-                        "step": "Analysis Agent",
-                        "content": f"🔍 Analyzing vulnerability patterns and details...",
-                        "trace_id": str(current_run_id),
-                        "external_trace_id": external_trace_id,
-                        "agent": "analysis"
-                    }
-                else:
-                    yield {
-                        "step": "Analysis Complete",
-                        "content": agent_message.content,
-                        "trace_id": str(current_run_id),
-                        "external_trace_id": external_trace_id,
-                        "agent": "analysis"
-                    }
-
-            elif "correlation" in chunk:
-                agent_message = chunk["correlation"]["messages"][-1]
-                if agent_message.tool_calls:
-                    yield {
-                        "step": "Correlation Agent",
-                        "content": f"🔗 Identifying relationships and attack chains...",
-                        "trace_id": str(current_run_id),
-                        "external_trace_id": external_trace_id,
-                        "agent": "correlation"
-                    }
-                else:
-                    yield {
-                        "step": "Correlation Complete",
-                        "content": agent_message.content,
-                        "trace_id": str(current_run_id),
-                        "external_trace_id": external_trace_id,
-                        "agent": "correlation"
-                    }
-
-            elif "risk" in chunk:
-                agent_message = chunk["risk"]["messages"][-1]
-                if agent_message.tool_calls:
-                    yield {
-                        "step": "Risk Assessment Agent",
-                        "content": f"⚠️ Calculating risk scores and assessing criticality...",
-                        "trace_id": str(current_run_id),
-                        "external_trace_id": external_trace_id,
-                        "agent": "risk"
-                    }
+        # "custom" carries the agents' in-progress events, "updates" each agent's final write-up
+        async for mode, chunk in multi_agent_chain.astream(inputs, config=config, stream_mode=["custom", "updates"]):
+            if mode == "custom":
+                yield {**chunk, "trace_id": str(current_run_id), "external_trace_id": external_trace_id}
+                continue
+            for agent, update in chunk.items():
+                if agent == "synthesizer":
+                    step = "Final Answer"
+                elif agent in AGENT_STEPS:
+                    step = AGENT_STEPS[agent][2]
                 else:
-                    yield {
-                        "step": "Risk Assessment Complete",
-                        "content": agent_message.content,
-                        "trace_id": str(current_run_id),
-                        "external_trace_id": external_trace_id,
-                        "agent": "risk"
-                    }
-
-            elif "recommendation" in chunk:
-                agent_message = chunk["recommendation"]["messages"][-1]
-                if agent_message.tool_calls:
-                    yield {
-                        "step": "Recommendation Agent",
-                        "content": f"💡 Generating mitigation strategies and remediation plans...",
-                        "trace_id": str(current_run_id),
-                        "external_trace_id": external_trace_id,
-                        "agent": "recommendation"
-                    }
-                else:
-                    yield {
-                        "step": "Recommendation Complete",
-                        "content": agent_message.content,
-                        "trace_id": str(current_run_id),
-                        "external_trace_id": external_trace_id,
-                        "agent": "recommendation"
-                    }
-
-            elif "tools" in chunk:
-                action_message = chunk["tools"]["messages"][-1]
+                    continue
                 yield {
-                    "step": "Tool Execution",
-                    "content": f"🛠️ {action_message.content}",
+                    "step": step,
+                    "content": update["messages"][-1].content,
                     "trace_id": str(current_run_id),
                     "external_trace_id": external_trace_id,
-                    "agent": "tools"
+                    "agent": agent
                 }
 
     except Exception as e:
-        print(f"[Multi-Agent STREAM ERROR] {type(e).__name__}: {e}")
+        log.error("Multi-agent stream error: %s: %s", type(e).__name__, e)
         yield {
             "step": "Error",
             "content": f"An error occurred: {e}",
             "trace_id": str(current_run_id),
             "external_trace_id": external_trace_id,
             "agent": "error"
-        } 
\ No newline at end of file
+        }
@@ -0,0 +1,117 @@
+# Query execution helpers shared by both agents (langgraph_agent.py on the sync driver,
+# multi_agent_system.py on the async one), so the budgets, encoding and error text stay identical.
+import os
+import re
+import itertools
+
+import orjson
+from neo4j import READ_ACCESS, unit_of_work
+from neo4j.exceptions import ClientError
+
+NEO4J_DATABASE = os.getenv("NEO4J_DATABASE")
+
+# Read-mode sessions (routable to replicas) with a fixed fetch size so Bolt streams rows in large batches
+READ_SESSION = {"database": NEO4J_DATABASE, "default_access_mode": READ_ACCESS, "fetch_size": 1000}
+
+# Caps on what a (possibly LLM-written) query can pull into memory and back into the prompt;
+# the result is re-sent as input on every later turn, so ~8 KB keeps it near 2k tokens
+QUERY_MAX_ROWS = 200
+QUERY_MAX_BYTES = 8192
+TRUNCATED_NOTE = b'"Result truncated; narrow the query with WHERE or a smaller LIMIT, or return fewer properties."'
+_LIMIT_RE = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+# Server-side transaction timeout: a runaway scan is killed instead of holding a pooled connection
+QUERY_TIMEOUT = float(os.getenv("NEO4J_QUERY_TIMEOUT", "5"))
+
+NO_RESULTS = "No results found for the query."
+TIMEOUT_MESSAGE = f"Error: the query timed out after {QUERY_TIMEOUT:g}s; narrow it with WHERE, fewer MATCH patterns or a smaller LIMIT."
+
+# Query ids only correlate log lines within this process, so a counter is enough
+query_ids = itertools.count()
+
+
+def json_default(value):
+    # orjson handles dicts, lists and Python datetimes in C; neo4j temporal types land here
+    iso = getattr(value, "iso_format", None) or getattr(value, "isoformat", None)
+    return iso() if iso else str(value)
+
+
+def _with_limit(query: str) -> str:
+    if _LIMIT_RE.search(query):
+        return query
+    return f"{query.rstrip().rstrip(';')}\nLIMIT {QUERY_MAX_ROWS}"
+
+
+def _encode_row(data: dict) -> bytes:
+    return orjson.dumps(data, default=json_default, option=orjson.OPT_NAIVE_UTC)
+
+
+def _summarize(data: dict) -> dict:
+    # Stands in for a first row that alone is over the byte budget (e.g. RETURN collect(...)), so the
+    # model sees the row's shape and the truncation note instead of an empty result
+    summary = {}
+    for key, value in data.items():
+        if isinstance(value, (list, tuple)):
+            summary[key] = {"_items": len(value)}
+        elif isinstance(value, dict):
+            summary[key] = {"_keys": list(value)}
+        elif isinstance(value, str) and len(value) > 200:
+            summary[key] = value[:200] + "..."
+        else:
+            summary[key] = value
+    return summary
+
+
+class _RowBudget:
+    """Collects encoded rows until the row or byte budget runs out."""
+
+    def __init__(self):
+        self.rows = []
+        self.size = 0
+        self.truncated = False
+
+    def add(self, data: dict) -> bool:
+        """Returns False once the budget is spent; the row that overflowed is only kept, summarized, if it was the first."""
+        if len(self.rows) >= QUERY_MAX_ROWS:
+            self.truncated = True
+            return False
+        # Each row is encoded once as it streams in; the byte budget and the final payload share that encoding
+        row = _encode_row(data)
+        self.size += len(row)
+        if self.size > QUERY_MAX_BYTES:
+            self.truncated = True
+            if not self.rows:
+                self.rows.append(_encode_row(_summarize(data)))
+            return False
+        self.rows.append(row)
+        return True
+
+
+@unit_of_work(timeout=QUERY_TIMEOUT)
+def bounded_records(tx, query, params=None):
+    """Runs the query with an injected LIMIT and stops reading at the row or byte budget."""
+    budget = _RowBudget()
+    for record in tx.run(_with_limit(query), params or {}):
+        if not budget.add(record.data()):
+            break
+    return budget.rows, budget.truncated
+
+
+@unit_of_work(timeout=QUERY_TIMEOUT)
+async def abounded_records(tx, query, params=None):
+    """Async twin of bounded_records for the async driver."""
+    budget = _RowBudget()
+    async for record in await tx.run(_with_limit(query), params or {}):
+        if not budget.add(record.data()):
+            break
+    return budget.rows, budget.truncated
+
+
+def encode_records(records, truncated) -> str:
+    # Compact JSON: indentation is only whitespace tokens for the model to read
+    rows = b"[" + b",".join(records) + b"]"
+    payload = b'{"records":' + rows + b',"_truncated":' + TRUNCATED_NOTE + b'}' if truncated else rows
+    return payload.decode()
+
+
+def is_timeout(e: Exception) -> bool:
+    return isinstance(e, ClientError) and "TransactionTimedOut" in (e.code or "")
@@ -0,0 +1,88 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+
+from cachetools import TTLCache
+
+from cypher_guard import forbidden_clause
+
+# Optional shared backend: Redis lets every worker process see the same cached results.
+try:
+    import redis
+except ImportError:
+    redis = None
+
+log = logging.getLogger(__name__)
+
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "300"))
+QUERY_CACHE_REDIS_URL = os.getenv("QUERY_CACHE_REDIS_URL") or os.getenv("LLM_CACHE_REDIS_URL")
+
+_KEY_PREFIX = "cypher:"
+_READ_ONLY = re.compile(r"^\s*MATCH\b", re.IGNORECASE)
+
+
+def cacheable(query: str) -> bool:
+    """Only plain read queries are cached; anything that could write or call a procedure is not."""
+    return bool(_READ_ONLY.match(query)) and forbidden_clause(query) is None
+
+
+def _key(query: str, params: dict = None) -> str:
+    # Whitespace-insensitive, but not case-folded: string literals in the query are case-sensitive
+    normalized = " ".join(query.split())
+    if params:
+        # A parameterized query's result depends on its bound values as much as on its text
+        normalized += "\0" + repr(sorted(params.items()))
+    return _KEY_PREFIX + hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """TTL cache of encoded Cypher results, in Redis when configured, else in process memory."""
+
+    def __init__(self, ttl: int = QUERY_CACHE_TTL, maxsize: int = 1024, redis_url: str = QUERY_CACHE_REDIS_URL):
+        self.ttl = ttl
+        self._redis = None
+        if redis_url and redis is not None:
+            self._redis = redis.Redis.from_url(redis_url)
+        elif redis_url:
+            log.warning("redis not installed; Cypher result cache is per-process.")
+        self._mem = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, query: str, params: dict = None):
+        key = _key(query, params)
+        if self._redis is not None:
+            try:
+                value = self._redis.get(key)
+                return value.decode("utf-8") if value is not None else None
+            except redis.RedisError as e:
+                log.warning("Cypher cache read failed: %s", e)
+                return None
+        with self._lock:
+            return self._mem.get(key)
+
+    def set(self, query: str, payload: str, params: dict = None):
+        key = _key(query, params)
+        if self._redis is not None:
+            try:
+                self._redis.setex(key, self.ttl, payload)
+            except redis.RedisError as e:
+                log.warning("Cypher cache write failed: %s", e)
+            return
+        with self._lock:
+            self._mem[key] = payload
+
+    def clear(self):
+        """Drops every cached result, e.g. after the graph has been written to."""
+        if self._redis is not None:
+            try:
+                for key in self._redis.scan_iter(match=_KEY_PREFIX + "*"):
+                    self._redis.delete(key)
+            except redis.RedisError as e:
+                log.warning("Cypher cache clear failed: %s", e)
+        with self._lock:
+            self._mem.clear()
+
+
+cache = QueryCache()
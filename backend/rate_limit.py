@@ -0,0 +1,48 @@
+import os
+import asyncio
+import time
+from collections import deque
+
+from aiolimiter import AsyncLimiter
+
+LITELLM_RPM = int(os.getenv("LITELLM_RPM", "500"))
+LITELLM_TPM = int(os.getenv("LITELLM_TPM", "150000"))
+
+
+class Throttle:
+    """Proactive RPM/TPM throttle for LiteLLM calls, so bursts wait locally instead of drawing 429s.
+
+    Requests are paced by a token bucket; tokens are tracked from each response's
+    usage over a rolling 60-second window. Create one per event loop (i.e. per run).
+    """
+
+    def __init__(self, rpm: int = LITELLM_RPM, tpm: int = LITELLM_TPM):
+        self.tpm = tpm
+        self._limiter = AsyncLimiter(rpm, 60)
+        self._window = deque()
+        self._used = 0
+
+    def _expire(self, now: float):
+        while self._window and self._window[0][0] <= now - 60:
+            _, tokens = self._window.popleft()
+            self._used -= tokens
+
+    async def acquire(self, estimated_tokens: int = 0):
+        await self._limiter.acquire()
+        while True:
+            now = time.monotonic()
+            self._expire(now)
+            if not self._window or self._used + estimated_tokens <= self.tpm:
+                return
+            # Wait for the oldest usage entry to fall out of the window
+            await asyncio.sleep(self._window[0][0] + 60 - now)
+
+    def record(self, tokens: int):
+        if tokens:
+            self._window.append((time.monotonic(), tokens))
+            self._used += tokens
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    # ~4 characters per token is close enough for budgeting
+    return len(prompt) // 4 + max_tokens
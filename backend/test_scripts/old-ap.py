@@ -106,10 +106,10 @@ def chat():
             term=user_msg,
         )
 
-        context = "\n".join([
+        context = "\n".join(
             f"[{r['severity']}] {r['title']} - {r['description']}"
             for r in result
-        ])
+        )
 
 
         prompt = f"""
@@ -3,49 +3,55 @@
 Test script to verify the agent can connect to Neo4j and execute queries
 """
 import os
+import traceback
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
+from neo4j import READ_ACCESS
+from common import init
 from langgraph_agent import stream_agent_steps
 
 # Load environment variables
 load_dotenv()
 
+VERBOSE_TRACE = os.getenv("VERBOSE_TRACE")
+
+COUNT_QUERY = "MATCH (n) RETURN count(n) as count"
+
+def _count_nodes(tx):
+    return tx.run(COUNT_QUERY).single()["count"]
+
 def test_agent_with_neo4j():
     """Test the agent with Neo4j connection"""
     print("Testing Agent with Neo4j")
     
     try:
-        # Create Neo4j driver
-        uri = os.getenv("NEO4J_URI")
-        user = os.getenv("NEO4J_USER")
-        password = os.getenv("NEO4J_PASSWORD")
-        
-        driver = GraphDatabase.driver(uri, auth=(user, password))
+        # The app's process-wide driver (pooled and closed at exit), without the schema DDL
+        driver = init(schema=False)
+        if driver is None:
+            print("Neo4j driver is not available")
+            return
         print("Neo4j driver created successfully")
         
         # Test a simple query first
-        with driver.session() as session:
-            result = session.run("MATCH (n) RETURN count(n) as count")
-            count = result.single()["count"]
+        with driver.session(default_access_mode=READ_ACCESS) as session:
+            count = session.execute_read(_count_nodes)
             print(f"Database has {count} nodes")
         
         # Test the agent
         test_query = "How many findings are in the database?"
         print(f"\nTesting agent with query: '{test_query}'")
         
-        steps = list(stream_agent_steps(test_query, db_driver=driver))
-        
+        # Each step is printed as the agent produces it rather than after the whole run
         print("\nAgent Steps:")
-        for i, step in enumerate(steps, 1):
-            print(f"{i}. {step['step']}: {step['content'][:100]}...")
+        for i, step in enumerate(stream_agent_steps(test_query, db_driver=driver), 1):
+            print(f"{i}. {step['step']}: {step['content'][:100]}...", flush=True)
         
-        driver.close()
         print("\nAgent test completed successfully!")
         
     except Exception as e:
         print(f"Agent test failed: {e}")
-        import traceback
-        traceback.print_exc()
+        # Full tracebacks only on request; the message above is enough for a connection flake
+        if VERBOSE_TRACE:
+            traceback.print_exc()
 
 if __name__ == "__main__":
     test_agent_with_neo4j() 
\ No newline at end of file
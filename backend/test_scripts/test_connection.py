@@ -3,93 +3,95 @@
 Test script to verify Neo4j and Litellm connections
 """
 import os
+import asyncio
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
-import requests
+try:
+    # Only for uvloop when available; the script also runs on its own (python test_scripts/...)
+    import async_runner
+except ImportError:
+    async_runner = None
+from neo4j import READ_ACCESS, AsyncGraphDatabase
+import httpx
 
 # Load environment variables
 load_dotenv()
 
+REQUIRED_VARS = ("NEO4J_URI", "NEO4J_USER", "NEO4J_PASSWORD", "LITELLM_BASE_URL", "LITELLM_API_KEY")
+
+# One snapshot of the environment, read at import and shared by every check below
+ENV = {var: os.getenv(var, "") for var in REQUIRED_VARS}
+NEO4J_URI = ENV["NEO4J_URI"]
+NEO4J_USER = ENV["NEO4J_USER"]
+NEO4J_PASSWORD = ENV["NEO4J_PASSWORD"]
+LITELLM_BASE_URL = ENV["LITELLM_BASE_URL"]
+LITELLM_API_KEY = ENV["LITELLM_API_KEY"]
+VERBOSE = os.getenv("VERBOSE")
+DEEP_CHECK = os.getenv("DEEP_CHECK")
+
 def test_env_variables():
     """Test if all required environment variables are set"""
     print("=== Testing Environment Variables ===")
     
-    required_vars = [
-        "NEO4J_URI",
-        "NEO4J_USER", 
-        "NEO4J_PASSWORD",
-        "LITELLM_BASE_URL",
-        "LITELLM_API_KEY"
-    ]
+    # The per-variable listing is only needed to diagnose a failure, or when asked for
+    if all(ENV.values()) and not VERBOSE:
+        print("All environment variables are set!")
+        return True
     
-    missing_vars = []
-    for var in required_vars:
-        value = os.getenv(var)
-        if value:
-            print(f"{var}: {value[:10]}..." if len(value) > 10 else f"{var}: {value}")
-        else:
-            print(f"{var}: NOT SET")
-            missing_vars.append(var)
+    for var, value in ENV.items():
+        print(f"{var}: {value[:10]}{'...' if len(value) > 10 else ''}" if value else f"{var}: NOT SET")
     
-    if missing_vars:
+    if missing_vars := [var for var, value in ENV.items() if not value]:
         print(f"\nMissing environment variables: {', '.join(missing_vars)}")
         print("Please set these in your .env file or environment")
         return False
-    else:
-        print("\nAll environment variables are set!")
-        return True
+    print("\nAll environment variables are set!")
+    return True
+
+SMOKE_QUERY = "RETURN 1 as test"
+
+async def _smoke_query(tx):
+    result = await tx.run(SMOKE_QUERY)
+    return await result.single()
 
-def test_neo4j_connection():
+async def test_neo4j_connection():
     """Test Neo4j connection"""
-    print("\n=== Testing Neo4j Connection ===")
-    
     try:
-        uri = os.getenv("NEO4J_URI")
-        user = os.getenv("NEO4J_USER")
-        password = os.getenv("NEO4J_PASSWORD")
-        
-        if not all([uri, user, password]):
+        if not all([NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD]):
             print("Neo4j environment variables not set")
             return False
         
-        driver = GraphDatabase.driver(uri, auth=(user, password))
-        driver.verify_connectivity()
-        print("Neo4j connection successful!")
-        
-        # Test a simple query
-        with driver.session() as session:
-            result = session.run("RETURN 1 as test")
-            record = result.single()
-            if record and record["test"] == 1:
-                print(f"Neo4j query test successful! {record}")
-                # print("✅ Neo4j query test successful!")
-            else:
-                print("Neo4j query test failed")
-                return False
+        async with AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
+            await driver.verify_connectivity()
+            print("Neo4j connection successful!")
+            
+            # verify_connectivity already proved the server answers; a query is only run for a deep check
+            if DEEP_CHECK:
+                async with driver.session(default_access_mode=READ_ACCESS) as session:
+                    record = await session.execute_read(_smoke_query)
+                    if record and record["test"] == 1:
+                        print(f"Neo4j query test successful! {record}")
+                        # print("✅ Neo4j query test successful!")
+                    else:
+                        print("Neo4j query test failed")
+                        return False
         
-        driver.close()
         return True
         
     except Exception as e:
         print(f"Neo4j connection failed: {e}")
         return False
 
-def test_litellm_connection():
+async def test_litellm_connection(client: httpx.AsyncClient):
     """Test Litellm connection"""
-    print("\n=== Testing Litellm Connection ===")
-    
     try:
-        base_url = os.getenv("LITELLM_BASE_URL")
-        api_key = os.getenv("LITELLM_API_KEY")
-        
-        if not all([base_url, api_key]):
+        if not all([LITELLM_BASE_URL, LITELLM_API_KEY]):
             print("Litellm environment variables not set")
             return False
         
         # Test with a simple completion request
-        url = f"{base_url.rstrip('/')}/chat/completions"
+        url = f"{LITELLM_BASE_URL.rstrip('/')}/chat/completions"
         headers = {
-            "Authorization": f"Bearer {api_key}",
+            "Authorization": f"Bearer {LITELLM_API_KEY}",
             "Content-Type": "application/json"
         }
         payload = {
@@ -98,7 +100,7 @@ def test_litellm_connection():
             "max_tokens": 10
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = await client.post(url, json=payload, headers=headers)
         
         if response.status_code == 200:
             print("Litellm connection successful!")
@@ -111,7 +113,7 @@ def test_litellm_connection():
         print(f"Litellm connection failed: {e}")
         return False
 
-def main():
+async def main():
     """Run all tests"""
     print("🔍 Testing application connections...\n")
     
@@ -125,9 +127,11 @@ def main():
         print("3. Run this test again")
         return
     
-    # Test connections
-    neo4j_ok = test_neo4j_connection()
-    litellm_ok = test_litellm_connection()
+    # The two services are independent, so both checks run at once
+    print("\n=== Testing Neo4j and Litellm Connections ===")
+    # One client for the run, opened on the same loop as the Neo4j check
+    async with httpx.AsyncClient(timeout=10) as client:
+        neo4j_ok, litellm_ok = await asyncio.gather(test_neo4j_connection(), test_litellm_connection(client))
     
     print("\n=== Summary ===")
     if neo4j_ok and litellm_ok:
@@ -136,4 +140,8 @@ def main():
         print("Some connections failed. Please check your configuration.")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    if async_runner is not None:
+        with async_runner.new_runner() as runner:
+            runner.run(main())
+    else:
+        asyncio.run(main()) 
\ No newline at end of file
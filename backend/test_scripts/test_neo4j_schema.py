@@ -3,60 +3,82 @@
 Test script to explore the Neo4j database schema and properties
 """
 import os
+import asyncio
+import traceback
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
+try:
+    # Only for uvloop when available; the script also runs on its own (python test_scripts/...)
+    import async_runner
+except ImportError:
+    async_runner = None
+from neo4j import READ_ACCESS, AsyncGraphDatabase
 
 # Load environment variables
 load_dotenv()
 
-def explore_neo4j_schema():
+NEO4J_URI = os.getenv("NEO4J_URI")
+NEO4J_USER = os.getenv("NEO4J_USER")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+VERBOSE_TRACE = os.getenv("VERBOSE_TRACE")
+
+# Every probe in one statement, so the whole exploration is a single round-trip. Property names
+# and types come from the schema procedure, which reads store metadata instead of sampling nodes
+SCHEMA_SAMPLE_QUERY = """
+    CALL {
+        CALL db.schema.nodeTypeProperties() YIELD nodeLabels, propertyName, propertyTypes
+        WITH nodeLabels, collect({name: propertyName, types: propertyTypes}) AS properties
+        RETURN 'Schema' AS kind, {labels: nodeLabels, properties: properties} AS item
+        UNION ALL
+        MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability)
+        RETURN 'Join' AS kind, {id: f.id, title: v.title} AS item LIMIT $join_limit
+    }
+    RETURN kind, item
+"""
+
+JOIN_SAMPLE_SIZE = 5
+
+async def _read_samples(tx):
+    result = await tx.run(SCHEMA_SAMPLE_QUERY, join_limit=JOIN_SAMPLE_SIZE)
+    return await result.data()
+
+async def explore_neo4j_schema():
     """Explore the actual schema and properties in Neo4j"""
     print("=== Exploring Neo4j Schema ===")
-    
+
     try:
         # Create Neo4j driver
-        uri = os.getenv("NEO4J_URI")
-        user = os.getenv("NEO4J_USER")
-        password = os.getenv("NEO4J_PASSWORD")
-        
-        driver = GraphDatabase.driver(uri, auth=(user, password))
-        print("Neo4j driver created successfully")
-        
-        with driver.session() as session:
-            # Get all Finding nodes and their properties
-            print("\n--- Finding Nodes ---")
-            result = session.run("MATCH (f:Finding) RETURN f LIMIT 3")
-            for record in result:
-                finding = record["f"]
-                print(f"Finding properties: {dict(finding)}")
-            
-            # Get all Vulnerability nodes and their properties
-            print("\n--- Vulnerability Nodes ---")
-            result = session.run("MATCH (v:Vulnerability) RETURN v LIMIT 3")
-            for record in result:
-                vuln = record["v"]
-                print(f"Vulnerability properties: {dict(vuln)}")
-            
-            # Get all Asset nodes and their properties
-            print("\n--- Asset Nodes ---")
-            result = session.run("MATCH (a:Asset) RETURN a LIMIT 3")
-            for record in result:
-                asset = record["a"]
-                print(f"Asset properties: {dict(asset)}")
-            
-            # Test the correct query
-            print("\n--- Correct Query Test ---")
-            result = session.run("MATCH (f:Finding)-[:HAS_VULNERABILITY]->(v:Vulnerability) RETURN f.id, v.title LIMIT 5")
-            for record in result:
-                print(f"Finding ID: {record['f.id']}, Title: {record['v.title']}")
-        
-        driver.close()
+        async with AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
+            print("Neo4j driver created successfully")
+
+            samples = {"Schema": [], "Join": []}
+            async with driver.session(default_access_mode=READ_ACCESS) as session:
+                rows = await session.execute_read(_read_samples)
+            for row in rows:
+                samples[row["kind"]].append(row["item"])
+
+        # Every node label and the properties (with their types) stored under it
+        for node_type in samples["Schema"]:
+            print(f"\n--- {':'.join(node_type['labels'])} Nodes ---")
+            for prop in node_type["properties"]:
+                if prop["name"] is not None:
+                    print(f"{prop['name']}: {', '.join(prop['types'] or [])}")
+
+        # Test the correct query
+        print("\n--- Correct Query Test ---")
+        for row in samples["Join"]:
+            print(f"Finding ID: {row['id']}, Title: {row['title']}")
+
         print("\nSchema exploration completed!")
-        
+
     except Exception as e:
         print(f"Schema exploration failed: {e}")
-        import traceback
-        traceback.print_exc()
+        # Full tracebacks only on request; the message above is enough for a connection flake
+        if VERBOSE_TRACE:
+            traceback.print_exc()
 
 if __name__ == "__main__":
-    explore_neo4j_schema() 
\ No newline at end of file
+    if async_runner is not None:
+        with async_runner.new_runner() as runner:
+            runner.run(explore_neo4j_schema())
+    else:
+        asyncio.run(explore_neo4j_schema())
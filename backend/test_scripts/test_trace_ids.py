@@ -1,61 +1,70 @@
 #!/usr/bin/env python3
 """
 Test script to demonstrate trace ID handling and parent run ID extraction.
+
+Run from the backend directory, like the other test scripts: python -m test_scripts.test_trace_ids
 """
 
-import os
 import sys
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-# Add the backend directory to the path
-sys.path.append('backend')
-
+from common import init
 from langgraph_agent import stream_agent_steps, ask_agent
-from neo4j import GraphDatabase
+
+# The app's driver setup, minus the schema DDL, which a read-only script has no reason to run
+driver = init(schema=False)
+
+_STEP_FORMAT = "  Step: {}\n  Trace ID: {}\n  External Trace ID: {}\n  Content: {}...\n\n"
+
+def _print_step(step):
+    # One write per step instead of five separate prints
+    sys.stdout.write(_STEP_FORMAT.format(
+        step["step"], step.get("trace_id", "N/A"), step.get("external_trace_id", "N/A"), step["content"][:100],
+    ))
+
+def _collect_steps(user_msg, external_trace_id=None):
+    return list(stream_agent_steps(user_msg, db_driver=driver, external_trace_id=external_trace_id))
 
 def test_trace_ids():
     """Test trace ID generation and extraction."""
     
-    # Initialize Neo4j driver
-    driver = GraphDatabase.driver(
-        os.getenv("NEO4J_URI", "bolt://localhost:7687"),
-        auth=(os.getenv("NEO4J_USER", "neo4j"), os.getenv("NEO4J_PASSWORD", "password"))
-    )
+    external_trace_id = str(uuid.uuid4())
+    user_msg = "What vulnerabilities are in finding F-101?"
+    external_trace_id_2 = str(uuid.uuid4())
+    user_msg_2 = "How many findings are there?"
+    user_msg_3 = "What is the most common vulnerability type?"
+    
+    # The three runs are independent, so they all start at once; results are printed in order below
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        run_1 = executor.submit(_collect_steps, user_msg, external_trace_id)
+        run_2 = executor.submit(ask_agent, user_msg_2, db_driver=driver, external_trace_id=external_trace_id_2)
+        run_3 = executor.submit(_collect_steps, user_msg_3)
     
     # Test 1: Streaming with external trace ID
     print("=" * 60)
     print("TEST 1: Streaming with external trace ID")
     print("=" * 60)
     
-    external_trace_id = str(uuid.uuid4())
     print(f"External Trace ID: {external_trace_id}")
     
-    user_msg = "What vulnerabilities are in finding F-101?"
-    
     print(f"\nUser Message: {user_msg}")
     print("\nStreaming response:")
     
-    for step in stream_agent_steps(user_msg, db_driver=driver, external_trace_id=external_trace_id):
-        print(f"  Step: {step['step']}")
-        print(f"  Trace ID: {step.get('trace_id', 'N/A')}")
-        print(f"  External Trace ID: {step.get('external_trace_id', 'N/A')}")
-        print(f"  Content: {step['content'][:100]}...")
-        print()
+    for step in run_1.result():
+        _print_step(step)
     
     # Test 2: Non-streaming with external trace ID
     print("=" * 60)
     print("TEST 2: Non-streaming with external trace ID")
     print("=" * 60)
     
-    external_trace_id_2 = str(uuid.uuid4())
     print(f"External Trace ID: {external_trace_id_2}")
     
-    user_msg_2 = "How many findings are there?"
-    
     print(f"\nUser Message: {user_msg_2}")
     
-    response = ask_agent(user_msg_2, db_driver=driver, external_trace_id=external_trace_id_2)
+    response = run_2.result()
     print(f"\nResponse: {response[:200]}...")
     
     # Test 3: Without external trace ID (LangGraph generates one)
@@ -63,19 +72,12 @@ def test_trace_ids():
     print("TEST 3: Without external trace ID (LangGraph generates one)")
     print("=" * 60)
     
-    user_msg_3 = "What is the most common vulnerability type?"
-    
     print(f"\nUser Message: {user_msg_3}")
     print("\nStreaming response:")
     
-    for step in stream_agent_steps(user_msg_3, db_driver=driver):
-        print(f"  Step: {step['step']}")
-        print(f"  Trace ID: {step.get('trace_id', 'N/A')}")
-        print(f"  External Trace ID: {step.get('external_trace_id', 'N/A')}")
-        print(f"  Content: {step['content'][:100]}...")
-        print()
+    for step in run_3.result():
+        _print_step(step)
     
-    driver.close()
     print("Test completed!")
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+# Run from backend/: python -m pytest tests
+import pytest
+
+from cypher_guard import check_cypher, forbidden_clause
+
+
+@pytest.mark.parametrize("query", [
+    "MATCH (v:Vulnerability) WHERE v.title CONTAINS 'Header Not Set' RETURN v.title",
+    "MATCH (v:Vulnerability) WHERE v.title = 'Set-Cookie' RETURN v",
+    "MATCH (v:Vulnerability) WHERE v.title = \"Cookie Without Secure Flag Set\" RETURN v.severity",
+    "MATCH (v:Vulnerability) WHERE v.description CONTAINS 'it\\'s possible to DELETE files' RETURN v",
+    "MATCH (n:`Set`) RETURN n LIMIT 5",
+    "MATCH (f:Finding) // set aside the old scan\nRETURN f.id",
+    "MATCH (f:Finding) /* CALL this later */ RETURN count(f)",
+    "MATCH (n:Finding) RETURN n.name AS set",
+    "MATCH (n:Finding) RETURN n.id AS delete, n.scanner AS create LIMIT 5",
+    "MATCH (set:Finding) WHERE set.scanner = $call RETURN set.id, {merge: set.id}",
+])
+def test_keywords_inside_literals_and_comments_are_allowed(query):
+    assert check_cypher(query) is None
+    assert forbidden_clause(query) is None
+
+
+@pytest.mark.parametrize("query, clause", [
+    ("MATCH (v:Vulnerability) SET v.title = 'x' RETURN v", "SET"),
+    ("MATCH (v:Vulnerability {title: 'Header Not Set'}) DETACH DELETE v RETURN 1", "DETACH"),
+    ("MATCH (n) CALL db.labels() YIELD label RETURN label", "CALL"),
+    ("MATCH (n) RETURN n UNION MATCH (m) MERGE (m)-[:X]->(m) RETURN m", "MERGE"),
+    ("MATCH (n) WITH n AS x SET x.seen = true RETURN x", "SET"),
+    ("MATCH (n) CREATE(m:Copy) RETURN n", "CREATE"),
+])
+def test_write_and_procedure_clauses_are_rejected(query, clause):
+    assert forbidden_clause(query) == clause
+    assert check_cypher(query) == f"Error: the {clause} clause is not allowed in queries."
+
+
+@pytest.mark.parametrize("query", [
+    "CREATE (n:Finding) RETURN n",
+    "RETURN 'MATCH (n) RETURN n'",
+    "MATCH (n) WHERE n.note = 'RETURN'",
+])
+def test_only_match_return_reads_are_allowed(query):
+    assert check_cypher(query) == "Error: only read queries of the form MATCH ... RETURN ... are allowed."
@@ -0,0 +1,51 @@
+# Run from backend/: python -m pytest tests
+import io
+import logging
+
+import orjson
+import pytest
+
+from log_setup import queue_logging
+
+
+def _emit(fmt, emit):
+    stream = io.StringIO()
+    handler, listener = queue_logging(fmt, stream)
+    logger = logging.getLogger(f"test_log_setup.{fmt}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    try:
+        emit(logger)
+    finally:
+        logger.removeHandler(handler)
+        listener.stop()
+    return stream.getvalue()
+
+
+def _log_failure(logger):
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("query %s failed", 7)
+
+
+def test_text_line_is_formatted_once():
+    out = _emit("text", lambda logger: logger.warning("hello %s", "world"))
+    line, = out.splitlines()
+    assert line.endswith(" WARNING test_log_setup.text hello world")
+    assert "WARNING:" not in line
+
+
+def test_json_line_keeps_message_and_traceback():
+    out = _emit("json", _log_failure)
+    entry = orjson.loads(out.splitlines()[0])
+    assert entry["message"] == "query 7 failed"
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "test_log_setup.json"
+    assert "ValueError: boom" in entry["exc_info"]
+
+
+@pytest.mark.parametrize("fmt", ["text", "json"])
+def test_traceback_reaches_the_output(fmt):
+    assert "ValueError: boom" in _emit(fmt, _log_failure)
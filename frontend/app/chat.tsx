@@ -37,7 +37,12 @@ const ChatPage = () => {
     setLoading(true)
     setAgentSteps([])
 
-    const steps: { step: string; content: string; trace_id?: string }[] = []
+    const steps: {
+      step: string
+      content: string
+      trace_id?: string
+      streaming?: boolean
+    }[] = []
 
     fetch("https://mindfort-a36d7c2f9939.herokuapp.com/chat/stream", {
       method: "POST",
@@ -81,7 +86,21 @@ const ChatPage = () => {
               if (line.startsWith("data: ")) {
                 try {
                   const stepObj = JSON.parse(line.slice(6))
-                  steps.push(stepObj)
+                  const last = steps[steps.length - 1]
+                  if (stepObj.step === "FinalAnswerDelta") {
+                    // Token deltas grow one in-progress answer entry
+                    if (last && last.streaming) last.content += stepObj.content
+                    else steps.push({ ...stepObj, step: "Final Answer", streaming: true })
+                  } else if (stepObj.step === "Final Answer" && last?.streaming) {
+                    steps[steps.length - 1] = stepObj
+                  } else {
+                    // Text streamed before a tool call was reasoning, not the answer
+                    if (last?.streaming) {
+                      last.step = "Thought"
+                      last.streaming = false
+                    }
+                    steps.push(stepObj)
+                  }
                   setAgentSteps([...steps])
                   // eslint-disable-next-line @typescript-eslint/no-unused-vars
                 } catch (e) {
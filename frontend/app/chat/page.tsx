@@ -44,6 +44,7 @@ const ChatPage = () => {
       content: string
       trace_id?: string
       agent?: string
+      streaming?: boolean
     }[] = []
 
     // Choose endpoint based on agent mode
@@ -93,7 +94,21 @@ const ChatPage = () => {
               if (line.startsWith("data: ")) {
                 try {
                   const stepObj = JSON.parse(line.slice(6))
-                  steps.push(stepObj)
+                  const last = steps[steps.length - 1]
+                  if (stepObj.step === "FinalAnswerDelta") {
+                    // Token deltas grow one in-progress answer entry
+                    if (last && last.streaming) last.content += stepObj.content
+                    else steps.push({ ...stepObj, step: "Final Answer", streaming: true })
+                  } else if (stepObj.step === "Final Answer" && last?.streaming) {
+                    steps[steps.length - 1] = stepObj
+                  } else {
+                    // Text streamed before a tool call was reasoning, not the answer
+                    if (last?.streaming) {
+                      last.step = "Thought"
+                      last.streaming = false
+                    }
+                    steps.push(stepObj)
+                  }
                   setAgentSteps([...steps])
                   // eslint-disable-next-line @typescript-eslint/no-unused-vars
                 } catch (e) {